@@ -5,8 +5,27 @@ import requests
 from io import BytesIO
 from shapely.geometry import LineString
 import copy
-from shapely.geometry import Polygon, Point
 import matplotlib.colors as mcolors
+from matplotlib.collections import LineCollection
+import os
+import hashlib
+import uuid
+import glob
+import time
+from race_line import (parallel_improve_race_line, anytime_improve_race_line, improve_race_line_section,
+                       section_indexes, SolveTelemetry)
+from speed_profile import race_line_leaderboard, batch_speed_profiles
+from hyperparameter_sweep import run_sweep, sweep_to_csv
+from solve_jobs import SolveJobManager
+from track_catalog import base_url, tracks, load_catalog_index
+from track_resample import resample_track, resample_closed_line
+from live_preview import RaceLinePreview
+from action_space import race_line_action_space, action_space_json, WHEELBASE
+from track_chart import track_chart, section_bounds
+from lap_robustness import robustness_analysis
+from race_line_export import (closest_point_grid, lookup_grid_source, race_line_bundle_bytes, is_race_line_bundle,
+                              load_race_line_bundle, fit_race_line_spline, race_line_spline_source, BUNDLE_MAGIC,
+                              BUNDLE_EXTENSION)
 
 # Function to plot the coordinates
 def plot_coords(ax, ob):
@@ -32,122 +51,6 @@ def print_border(ax, waypoints, inner_border_waypoints, outer_border_waypoints):
     plot_coords(ax, line)
     plot_line(ax, line)
 
-def menger_curvature(pt1, pt2, pt3, atol=1e-3):
-    vec21 = np.array(pt1) - np.array(pt2)
-    vec23 = np.array(pt3) - np.array(pt2)
-    norm21 = np.linalg.norm(vec21)
-    norm23 = np.linalg.norm(vec23)
-    theta = np.arccos(np.dot(vec21, vec23) / (norm21 * norm23))
-    if np.isclose(theta - np.pi, 0.0, atol=atol):
-        theta = 0.0
-    dist13 = np.linalg.norm(np.array(pt1) - np.array(pt3))
-    return 2 * np.sin(theta) / dist13 if dist13 != 0 else 0
-
-
-def improve_race_line(old_line, inner_border, outer_border):
-    '''Use gradient descent, inspired by K1999, to find the racing line'''
-    # start with the center line
-    new_line = copy.deepcopy(old_line)
-    ls_inner_border = Polygon(inner_border)
-    ls_outer_border = Polygon(outer_border)
-    for i in range(0,len(new_line)):
-        xi = new_line[i]
-        npoints = len(new_line)
-        prevprev = (i - 2 + npoints) % npoints
-        prev = (i - 1 + npoints) % npoints
-        nexxt = (i + 1 + npoints) % npoints
-        nexxtnexxt = (i + 2 + npoints) % npoints
-        #print("%d: %d %d %d %d %d" % (npoints, prevprev, prev, i, nexxt, nexxtnexxt))
-        ci = menger_curvature(new_line[prev], xi, new_line[nexxt])
-        c1 = menger_curvature(new_line[prevprev], new_line[prev], xi)
-        c2 = menger_curvature(xi, new_line[nexxt], new_line[nexxtnexxt])
-        target_ci = (c1 + c2) / 2
-        #print("i %d ci %f target_ci %f c1 %f c2 %f" % (i, ci, target_ci, c1, c2))
-
-        # Calculate prospective new track position, start at half-way (curvature zero)
-        xi_bound1 = copy.deepcopy(xi)
-        xi_bound2 = ((new_line[nexxt][0] + new_line[prev][0]) / 2.0, (new_line[nexxt][1] + new_line[prev][1]) / 2.0)
-        p_xi = copy.deepcopy(xi)
-        for j in range(0,XI_ITERATIONS):
-            p_ci = menger_curvature(new_line[prev], p_xi, new_line[nexxt])
-            #print("i: {} iter {} p_ci {} p_xi {} b1 {} b2 {}".format(i,j,p_ci,p_xi,xi_bound1, xi_bound2))
-            if np.isclose(p_ci, target_ci):
-                break
-            if p_ci < target_ci:
-                # too flat, shrinking track too much
-                xi_bound2 = copy.deepcopy(p_xi)
-                new_p_xi = ((xi_bound1[0] + p_xi[0]) / 2.0, (xi_bound1[1] + p_xi[1]) / 2.0)
-                if Point(new_p_xi).within(ls_inner_border) or not Point(new_p_xi).within(ls_outer_border):
-                    xi_bound1 = copy.deepcopy(new_p_xi)
-                else:
-                    p_xi = new_p_xi
-            else:
-                # too curved, flatten it out
-                xi_bound1 = copy.deepcopy(p_xi)
-                new_p_xi = ((xi_bound2[0] + p_xi[0]) / 2.0, (xi_bound2[1] + p_xi[1]) / 2.0)
-
-                # If iteration pushes the point beyond the border of the track,
-                # just abandon the refinement at this point.  As adjacent
-                # points are adjusted within the track the point should gradually
-                # make its way to a new position.  A better way would be to use
-                # a projection of the point on the border as the new bound.  Later.
-                if Point(new_p_xi).within(ls_inner_border) or not Point(new_p_xi).within(ls_outer_border):
-                    xi_bound2 = copy.deepcopy(new_p_xi)
-                else:
-                    p_xi = new_p_xi
-        new_xi = p_xi
-        # New point which has mid-curvature of prev and next points but may be outside of track
-        #print((new_line[i], new_xi))
-        new_line[i] = new_xi
-    return new_line
-
-# Define the URL structure for GitHub raw content
-base_url = "https://raw.githubusercontent.com/aws-deepracer-community/deepracer-race-data/main/raw_data/tracks/npy/"
-tracks = [
-    "2022_april_open.npy", "2022_april_open_ccw.npy", "2022_april_open_cw.npy",
-    "2022_april_pro.npy", "2022_april_pro_ccw.npy", "2022_april_pro_cw.npy",
-    "2022_august_open.npy", "2022_august_open_ccw.npy", "2022_august_open_cw.npy",
-    "2022_august_pro.npy", "2022_august_pro_ccw.npy", "2022_august_pro_cw.npy",
-    "2022_july_open.npy", "2022_july_pro.npy", "2022_july_pro_ccw.npy", "2022_july_pro_cw.npy",
-    "2022_june_open.npy", "2022_june_open_ccw.npy", "2022_june_open_cw.npy",
-    "2022_june_pro.npy", "2022_june_pro_ccw.npy", "2022_june_pro_cw.npy",
-    "2022_march_open.npy", "2022_march_open_ccw.npy", "2022_march_open_cw.npy",
-    "2022_march_pro.npy", "2022_march_pro_ccw.npy", "2022_march_pro_cw.npy",
-    "2022_may_open.npy", "2022_may_open_ccw.npy", "2022_may_open_cw.npy",
-    "2022_may_pro.npy", "2022_may_pro_ccw.npy", "2022_may_pro_cw.npy",
-    "2022_october_open.npy", "2022_october_open_ccw.npy", "2022_october_open_cw.npy",
-    "2022_october_pro.npy", "2022_october_pro_ccw.npy", "2022_october_pro_cw.npy",
-    "2022_reinvent_champ.npy", "2022_reinvent_champ_ccw.npy", "2022_reinvent_champ_cw.npy",
-    "2022_september_open.npy", "2022_september_open_ccw.npy", "2022_september_open_cw.npy",
-    "2022_september_pro.npy", "2022_september_pro_ccw.npy", "2022_september_pro_cw.npy",
-    "2022_summit_speedway.npy", "2022_summit_speedway_ccw.npy", "2022_summit_speedway_cw.npy", "2022_summit_speedway_mini.npy",
-    "AWS_track.npy", "Albert.npy", "AmericasGeneratedInclStart.npy",
-    "Aragon.npy", "Austin.npy", "Belille.npy",
-    "Bowtie_track.npy", "Canada_Training.npy", "China_track.npy",
-    "FS_June2020.npy", "H_track.npy", "July_2020.npy",
-    "LGSWide.npy", "Mexico_track.npy", "Monaco.npy",
-    "Monaco_building.npy", "New_York_Track.npy", "Oval_track.npy",
-    "Singapore.npy", "Singapore_building.npy", "Singapore_f1.npy",
-    "Spain_track.npy", "Spain_track_f1.npy", "Straight_track.npy",
-    "Tokyo_Training_track.npy", "Vegas_track.npy", "Virtual_May19_Train_track.npy",
-    "arctic_open.npy", "arctic_open_ccw.npy", "arctic_open_cw.npy",
-    "arctic_pro.npy", "arctic_pro_ccw.npy", "arctic_pro_cw.npy",
-    "caecer_gp.npy", "caecer_loop.npy", "dubai_open.npy",
-    "dubai_open_ccw.npy", "dubai_open_cw.npy", "dubai_pro.npy",
-    "hamption_open.npy", "hamption_pro.npy", "jyllandsringen_open.npy",
-    "jyllandsringen_open_ccw.npy", "jyllandsringen_open_cw.npy", "jyllandsringen_pro.npy",
-    "jyllandsringen_pro_ccw.npy", "jyllandsringen_pro_cw.npy", "morgan_open.npy",
-    "morgan_pro.npy", "penbay_open.npy", "penbay_open_ccw.npy",
-    "penbay_open_cw.npy", "penbay_pro.npy", "penbay_pro_ccw.npy",
-    "penbay_pro_cw.npy", "reInvent2019_track.npy", "reInvent2019_track_ccw.npy",
-    "reInvent2019_track_cw.npy", "reInvent2019_wide.npy", "reInvent2019_wide_ccw.npy",
-    "reInvent2019_wide_cw.npy", "reInvent2019_wide_mirrored.npy", "red_star_open.npy",
-    "red_star_pro.npy", "red_star_pro_ccw.npy", "red_star_pro_cw.npy",
-    "reinvent_base.npy", "thunder_hill_open.npy", "thunder_hill_pro.npy",
-    "thunder_hill_pro_ccw.npy", "thunder_hill_pro_cw.npy"
-]
-
-
 def load_npy_from_url(url):
     """Load .npy file from a URL."""
     response = requests.get(url)
@@ -164,54 +67,79 @@ def create_download_link(loop_race_line):
     buffer.seek(0)
     return buffer
 
-def circle_radius(coords):
-    x1, y1, x2, y2, x3, y3 = [i for sub in coords for i in sub]
-    a = x1*(y2-y3) - y1*(x2-x3) + x2*y3 - x3*y2
-    b = (x1**2+y1**2)*(y3-y2) + (x2**2+y2**2)*(y1-y3) + (x3**2+y3**2)*(y2-y1)
-    c = (x1**2+y1**2)*(x2-x3) + (x2**2+y2**2)*(x3-x1) + (x3**2+y3**2)*(x1-x2)
-    d = (x1**2+y1**2)*(x3*y2-x2*y3) + (x2**2+y2**2) * (x1*y3-x3*y1) + (x3**2+y3**2)*(x2*y1-x1*y2)
+def load_race_line(source):
+    """Load a saved optimal race line (bundle path/bytes or .npy) as an (N, 2) array without its closing point.
+
+    Raises ValueError for files that are not a race line.
+    """
+    if isinstance(source, str):
+        with open(source, 'rb') as f:
+            head = f.read(len(BUNDLE_MAGIC))
+    else:
+        head = source
+    if is_race_line_bundle(head):
+        # Bundles store the race line open, and paths are memory mapped rather than read
+        return load_race_line_bundle(source)['race_line']
     try:
-        r = abs((b**2+c**2-4*a*d) / abs(4*a**2)) ** 0.5
-    except:
-        r = 999
-    return r
-
-def circle_indexes(mylist, index_car, add_index_1=0, add_index_2=0):
-    list_len = len(mylist)
-    index_1 = (index_car + add_index_1) % list_len
-    index_2 = (index_car + add_index_2) % list_len
-    return [index_car, index_1, index_2]
-
-def optimal_velocity(track, min_speed, max_speed, look_ahead_points):
-    radius = []
-    for i in range(len(track)):
-        indexes = circle_indexes(track, i, add_index_1=-1, add_index_2=1)
-        coords = [track[indexes[0]], track[indexes[1]], track[indexes[2]]]
-        radius.append(circle_radius(coords))
-    v_min_r = min(radius)**0.5
-    constant_multiple = min_speed / v_min_r
-    if look_ahead_points == 0:
-        max_velocity = [(constant_multiple * i**0.5) for i in radius]
-        velocity = [min(v, max_speed) for v in max_velocity]
-        return velocity
+        line = np.load(source if isinstance(source, str) else BytesIO(source))
+    except (OSError, EOFError) as e:
+        raise ValueError(f"Not a .npy file: {e}")
+    if line.ndim != 2 or line.shape[1] < 2 or len(line) < 4 or not np.issubdtype(line.dtype, np.number):
+        raise ValueError("Expected rows of race line x/y")
+    return np.asarray(line, dtype=np.float64)[:-1, :2]
+
+@st.cache_resource(max_entries=16, show_spinner=False)
+def _decode_upload(digest, _data, kind):
+    """Decode an upload once per content hash; the array is shared between reruns and sessions, so read-only."""
+    if kind == "race_line":
+        array = load_race_line(_data)
     else:
-        LOOK_AHEAD_POINTS = look_ahead_points
-        radius_lookahead = []
-        for i in range(len(radius)):
-            next_n_radius = []
-            for j in range(LOOK_AHEAD_POINTS+1):
-                index = circle_indexes(mylist=radius, index_car=i, add_index_1=j)[1]
-                next_n_radius.append(radius[index])
-            radius_lookahead.append(min(next_n_radius))
-        max_velocity_lookahead = [(constant_multiple * i**0.5) for i in radius_lookahead]
-        velocity_lookahead = [min(v, max_speed) for v in max_velocity_lookahead]
-        return velocity_lookahead
-    
-def dist_2_points(x1, x2, y1, y2):
-    return abs(abs(x1-x2)**2 + abs(y1-y2)**2)**0.5
+        array = np.load(BytesIO(_data), allow_pickle=True)
+    array.flags.writeable = False
+    return array
+
+def decode_upload(uploaded_file, kind="track"):
+    """Decoded contents of an uploaded track or race line file, cached by content hash across reruns."""
+    data = uploaded_file.getvalue()
+    return _decode_upload(hashlib.blake2b(data, digest_size=16).hexdigest(), data, kind)
+
+def track_digest(waypoints):
+    """Content hash of a track, to tell whether stored results belong to the track loaded now."""
+    return hashlib.blake2b(np.ascontiguousarray(waypoints, dtype=np.float64).tobytes(), digest_size=16).hexdigest()
+
+@st.cache_resource
+def get_catalog_index():
+    """Track catalog metadata, read once per server."""
+    return load_catalog_index()
+
+@st.cache_resource
+def get_solve_job_manager():
+    """Solve queue and solver slots shared by every session of this server."""
+    return SolveJobManager(max_workers=os.cpu_count() or 1)
+
+def abandon_solve_job(keep=None):
+    """Stop waiting on this session's queued solve unless it is keep, which becomes the one waited on."""
+    previous = st.session_state.get('solve_job')
+    if previous is not None and previous is not keep:
+        get_solve_job_manager().cancel(previous, st.session_state.session_id)
+    st.session_state.solve_job = keep
+
+@st.experimental_fragment
+def show_track_chart(waypoints=None, race_line=None, speed=None, title="", key="track_chart"):
+    """Client-side zoomable track chart; the detail window reruns only this chart."""
+    line = race_line if race_line is not None else waypoints
+    npoints = len(line) - 1
+    st.caption("Drag to pan and scroll to zoom. Narrow the detail window to load full detail for part of the track.")
+    window = st.slider('Detail Window (points)', min_value=0, max_value=npoints, value=(0, npoints), key=f"{key}_window")
+    view = None if window == (0, npoints) else section_bounds(line, window[0], window[1])
+    data, spec = track_chart(waypoints, race_line, speed, view=view, title=title)
+    st.vega_lite_chart(data, spec, theme=None)
+
 #####################################################################
 st.sidebar.title("Navigation")
-page = st.sidebar.radio("Go to", ["Original & Optimal Race Line Visualization", "Optimal Speed Calculation"])
+page = st.sidebar.radio("Go to", ["Original & Optimal Race Line Visualization", "Optimal Speed Calculation", "Hyperparameter Sweep", "Race Line Leaderboard"])
+# Interactive charts are drawn in the browser from decimated line data instead of matplotlib images
+RENDERER = st.sidebar.radio("Track Charts", ["Static", "Interactive"])
 
 if page == "Original & Optimal Race Line Visualization":
     st.title('AWS DeepRacer Race Track Visualization')
@@ -229,6 +157,12 @@ if page == "Original & Optimal Race Line Visualization":
 
     if 'loop_race_line' not in st.session_state:
         st.session_state.loop_race_line = None
+
+    if 'preview_race_line' not in st.session_state:
+        st.session_state.preview_race_line = None
+
+    if 'session_id' not in st.session_state:
+        st.session_state.session_id = uuid.uuid4().hex
         
     
     # Ensure session state variables are initialized
@@ -241,10 +175,47 @@ if page == "Original & Optimal Race Line Visualization":
     if option == "Upload File":
         uploaded_file = st.file_uploader("Upload your track file (.npy)", type="npy")
         if uploaded_file is not None:
-            st.session_state.waypoints = np.load(uploaded_file, allow_pickle=True)
+            st.session_state.waypoints = decode_upload(uploaded_file)
     elif option == "GitHub":
-        selected_track = st.selectbox("Select a track", tracks)
-        if st.button("Load Track from GitHub"):
+        catalog_index = get_catalog_index()
+        track_choices = tracks
+        indexed = [catalog_index[name] for name in tracks if name in catalog_index]
+        if indexed:
+            # Filter and sort on the prebuilt metadata, no downloads needed
+            lengths = [entry["length"] for entry in indexed]
+            LENGTH_RANGE = st.slider('Track Length', min_value=float(np.floor(min(lengths))),
+                                     max_value=float(np.ceil(max(lengths))),
+                                     value=(float(np.floor(min(lengths))), float(np.ceil(max(lengths)))))
+            MIN_TRACK_WIDTH = st.slider('Minimum Track Width', min_value=0.0, max_value=2.0, value=0.0, step=0.05)
+            DIRECTIONS = st.multiselect('Direction', ["ccw", "cw"], default=["ccw", "cw"])
+            SORT_BY = st.selectbox('Sort by', ["name", "length", "min_width", "mean_width", "waypoints", "max_curvature"])
+            indexed = [entry for entry in indexed
+                       if LENGTH_RANGE[0] <= entry["length"] <= LENGTH_RANGE[1]
+                       and entry["min_width"] >= MIN_TRACK_WIDTH and entry["direction"] in DIRECTIONS]
+            indexed.sort(key=lambda entry: entry[SORT_BY])
+            st.dataframe([{key: value for key, value in entry.items() if key not in ("thumbnail", "bbox")} for entry in indexed])
+            track_choices = [entry["name"] for entry in indexed] + [name for name in tracks if name not in catalog_index]
+        else:
+            st.info("Run `python track_catalog.py` to build the track catalog index for filtering and previews.")
+        selected_track = st.selectbox("Select a track", track_choices)
+        if selected_track in catalog_index:
+            # Preview from the index thumbnail
+            thumbnail = catalog_index[selected_track]["thumbnail"]
+            fig, ax = plt.subplots(figsize=(4, 2.5), facecolor='black')
+            ax.set_aspect('equal')
+            ax.axis('off')
+            for part in ("inner", "outer", "center"):
+                outline = np.array(thumbnail[part])
+                ax.plot(outline[:, 0], outline[:, 1], color='cyan' if part != "center" else '#999999', linewidth=1)
+            st.pyplot(fig, use_container_width=False)
+            if "variant_of" in catalog_index[selected_track]:
+                st.info(f"Same layout as {catalog_index[selected_track]['variant_of']} "
+                        f"({catalog_index[selected_track]['variant']}). With 1 parallel worker and no time budget, a solve "
+                        f"of either with the same iteration settings is reused for the other while it is queued, running "
+                        f"or among the last {get_solve_job_manager().max_results} finished on this server.")
+        if selected_track is None:
+            st.warning("No tracks match these filters.")
+        if st.button("Load Track from GitHub", disabled=selected_track is None):
             # Load the data and store it in session state
             st.session_state.waypoints = load_npy_from_url(f"{base_url}{selected_track}")
     
@@ -254,28 +225,36 @@ if page == "Original & Optimal Race Line Visualization":
         center_line = waypoints[:, 0:2]
         inner_border = waypoints[:, 2:4]
         outer_border = waypoints[:, 4:6]
-    
-    
-    
+        # A race line solved on another track does not apply to this one
+        loaded_track = track_digest(waypoints)
+        if st.session_state.get('loop_race_line_track') != loaded_track:
+            st.session_state.loop_race_line = None
+            st.session_state.loop_race_line_track = loaded_track
+
+
+
             # Plotting
-        fig, ax = plt.subplots(figsize=(16, 10), facecolor='black')
-        ax.set_aspect('equal')
-        ax.set_facecolor('black')  # Set the axes background color
-        fig.patch.set_facecolor('black')  # Set the figure background color
+        if RENDERER == "Interactive":
+            show_track_chart(waypoints, title='Original Race Line', key="original_chart")
+        else:
+            fig, ax = plt.subplots(figsize=(16, 10), facecolor='black')
+            ax.set_aspect('equal')
+            ax.set_facecolor('black')  # Set the axes background color
+            fig.patch.set_facecolor('black')  # Set the figure background color
     
-        # Remove axis ticks
-        ax.tick_params(axis='both', colors='white')  # Make ticks white
+            # Remove axis ticks
+            ax.tick_params(axis='both', colors='white')  # Make ticks white
     
-        # Set grid and labels with appropriate colors if necessary
-        ax.xaxis.label.set_color('white')
-        ax.yaxis.label.set_color('white')
-        ax.grid(True, which='both', color='gray', linestyle='--', linewidth=0.5)  # Optional grid
+            # Set grid and labels with appropriate colors if necessary
+            ax.xaxis.label.set_color('white')
+            ax.yaxis.label.set_color('white')
+            ax.grid(True, which='both', color='gray', linestyle='--', linewidth=0.5)  # Optional grid
     
-        print_border(ax, center_line, inner_border, outer_border)
+            print_border(ax, center_line, inner_border, outer_border)
         
-        ax.set_title('Original Race Line', color='white', fontsize=20)
-        st.session_state.race_line_fig = fig
-        st.pyplot(fig)
+            ax.set_title('Original Race Line', color='white', fontsize=20)
+            st.session_state.race_line_fig = fig
+            st.pyplot(fig)
         
         # Set default iteration values
         #LINE_ITERATIONS = 1000
@@ -284,29 +263,141 @@ if page == "Original & Optimal Race Line Visualization":
         st.write("## Choose your Hyperparameters:")
         st.markdown("- Number of Line Iterations: Number of times to scan the entire race track to iterate")
         st.markdown("- Xi Iterations: Number of times to iterate each new race line point")
+        st.markdown("- Parallel Workers: Number of processes that each solve a contiguous segment of the track (1 = no splitting)")
+        st.markdown("- Time Budget: Run as many iterations as fit in this many seconds and keep the best line found (0 = run all Line Iterations)")
     
         LINE_ITERATIONS = st.slider('Number of Line Iterations', min_value=100, max_value=2000, value=500, step=100)
         XI_ITERATIONS = st.slider('Xi Iterations', min_value=3, max_value=10, value=5)
+        PARALLEL_WORKERS = st.number_input('Parallel Workers', min_value=1, max_value=os.cpu_count() or 1, value=1)
+        TIME_BUDGET = st.slider('Time Budget (seconds)', min_value=0, max_value=300, value=0, step=5)
+        RESAMPLE_TRACK = st.checkbox('Resample Track Before Solving')
+        if RESAMPLE_TRACK:
+            st.markdown("- Solver Points: Evenly spaced points to solve on (fewer is faster, more is smoother)")
+            st.markdown("- Output Points: Number of points in the downloaded race line")
+            SOLVER_POINTS = st.slider('Solver Points', min_value=20, max_value=max(4 * (len(center_line) - 1), 100),
+                                      value=len(center_line) - 1)
+            OUTPUT_POINTS = st.number_input('Output Points', min_value=20, max_value=10000, value=len(center_line) - 1)
+            st.write(f"Solver point spacing: {LineString(center_line).length / SOLVER_POINTS:.3f}")
     
-        if st.button('Calculate Optimal Race Line'):
-            race_line = copy.deepcopy(center_line[:-1])  # Start with a deep copy of the centerline
+        LIVE_PREVIEW = st.checkbox('Live Preview While Solving', value=True)
+
+        calculate = st.button('Calculate Optimal Race Line')
+        # Clicking this during a solve interrupts the run; the rerun keeps the line found so far
+        stop_early = st.button('Stop and Keep Current Line')
+        # A partial line is only kept for the track and settings it was solved with
+        solve_settings = (loaded_track, SOLVER_POINTS if RESAMPLE_TRACK else None, LINE_ITERATIONS, XI_ITERATIONS)
+        if st.session_state.get('preview_race_line_key') != solve_settings:
+            st.session_state.preview_race_line = None
+        if stop_early:
+            abandon_solve_job()
+        if stop_early and st.session_state.preview_race_line is None:
+            st.info("No partial race line to keep for this track and these settings.")
+        if calculate or (stop_early and st.session_state.preview_race_line is not None):
+            # Solve on an evenly spaced copy of the track when resampling
+            solve_waypoints = resample_track(waypoints, npoints=SOLVER_POINTS) if RESAMPLE_TRACK else waypoints
+            solve_inner_border = solve_waypoints[:, 2:4]
+            solve_outer_border = solve_waypoints[:, 4:6]
+            race_line = copy.deepcopy(solve_waypoints[:-1, 0:2])  # Start with a deep copy of the centerline
     
             # Initialize a progress bar
             progress_bar = st.progress(0)
             status_text = st.empty()
+            solve_start = time.perf_counter()
+            preview_slot = st.empty()
+            preview = RaceLinePreview(solve_inner_border, solve_outer_border) if LIVE_PREVIEW else None
+            if calculate:
+                st.session_state.preview_race_line = None
+                st.session_state.preview_race_line_key = solve_settings
+
+            def keep_partial(line):
+                # What Stop keeps if it interrupts this solve
+                st.session_state.preview_race_line = np.array(line)
+
+            def show_preview(line, keep=True):
+                # Stop keeps the latest line whether or not the live preview is on
+                if keep:
+                    keep_partial(line)
+                # Throttled by time inside the preview, so this is cheap to call every pass
+                frame = preview.render(line) if preview else None
+                if frame is not None:
+                    preview_slot.image(frame, caption="Current race line")
+
+            def wait_for_solvers():
+                status_text.text("Waiting for free solvers...")
+
+            def eta_text(i):
+                rate = i / (time.perf_counter() - solve_start)
+                return f"{rate:.1f} iterations/s, about {(LINE_ITERATIONS - i) / rate:.0f}s left"
     
-            for i in range(LINE_ITERATIONS):
-                race_line = improve_race_line(race_line, inner_border, outer_border)
-                
-                # Update progress bar and status text every 20 iterations
-                if i % 20 == 0:
-                    progress_percentage = int(100 * (i / LINE_ITERATIONS))
-                    progress_bar.progress(progress_percentage)
-                    status_text.text(f"Computing... Iteration {i} of {LINE_ITERATIONS}")
+            telemetry = SolveTelemetry(LINE_ITERATIONS)
+            if not calculate:
+                telemetry = None
+                race_line = st.session_state.preview_race_line
+                st.write("Stopped early, keeping the race line found so far")
+            elif TIME_BUDGET > 0:
+                # Anytime solve: keep iterating until the budget runs out and return the best line so far
+                def show_budget_progress(i, rate, best_score):
+                    elapsed = time.perf_counter() - solve_start
+                    progress_bar.progress(min(100, int(100 * elapsed / TIME_BUDGET)))
+                    status_text.text(f"Computing... Iteration {i}, {rate:.1f} iterations/s, "
+                                     f"about {max(0, TIME_BUDGET - elapsed):.0f}s left (best score {best_score:.2f})")
+                def show_current(line):
+                    # Stop keeps the best line, which need not be the one on screen
+                    show_preview(line, keep=False)
+                abandon_solve_job()
+                # Runs in this script thread, but still takes a slot of the server-wide solver pool
+                with get_solve_job_manager().reserve(1, waiting=wait_for_solvers):
+                    solve_start = time.perf_counter()
+                    race_line, passes_done, passes_per_second = anytime_improve_race_line(
+                        race_line, solve_inner_border, solve_outer_border, TIME_BUDGET, XI_ITERATIONS, progress=show_budget_progress,
+                        preview=show_current if preview else None, telemetry=telemetry, best=keep_partial)
+                st.write(f"Ran {passes_done} iterations in {TIME_BUDGET}s ({passes_per_second:.1f} iterations/s)")
+            elif PARALLEL_WORKERS > 1:
+                # Split the loop into segments solved side by side, exchanging halo points every pass
+                def show_progress(i):
+                    if i % 20 == 0:
+                        progress_bar.progress(int(100 * (i / LINE_ITERATIONS)))
+                        status_text.text(f"Computing... Iteration {i} of {LINE_ITERATIONS} on {PARALLEL_WORKERS} workers, {eta_text(i)}")
+                abandon_solve_job()
+                with get_solve_job_manager().reserve(PARALLEL_WORKERS, waiting=wait_for_solvers) as workers:
+                    solve_start = time.perf_counter()
+                    race_line = parallel_improve_race_line(race_line, solve_inner_border, solve_outer_border, LINE_ITERATIONS,
+                                                           XI_ITERATIONS, workers=workers, progress=show_progress,
+                                                           preview=show_preview, telemetry=telemetry)
+            else:
+                # Shared solve queue: identical requests from any session wait on the same job
+                solve_jobs = get_solve_job_manager()
+                job = solve_jobs.submit(st.session_state.session_id, solve_waypoints, LINE_ITERATIONS, XI_ITERATIONS)
+                abandon_solve_job(keep=job)
+                while not job.done():
+                    position = solve_jobs.queue_position(job)
+                    if position:
+                        status_text.text(f"Waiting for a free solver... position {position} in the queue")
+                    else:
+                        i = solve_jobs.progress(job)
+                        progress_bar.progress(int(100 * (i / LINE_ITERATIONS)))
+                        if i:
+                            rate = i / (time.time() - job.started)
+                            status_text.text(f"Computing... Iteration {i} of {LINE_ITERATIONS}, "
+                                             f"{rate:.1f} iterations/s, about {(LINE_ITERATIONS - i) / rate:.0f}s left")
+                        else:
+                            status_text.text(f"Computing... Iteration 0 of {LINE_ITERATIONS}")
+                        snapshot = solve_jobs.snapshot(job)
+                        if snapshot is not None:
+                            show_preview(snapshot)
+                    time.sleep(0.5)
+                race_line = job.result()
+                telemetry = job.telemetry
+                abandon_solve_job()
     
             # Complete the progress
             progress_bar.progress(100)
             status_text.text("Calculation completed!")
+            preview_slot.empty()
+            st.session_state.preview_race_line = None
+
+            if RESAMPLE_TRACK:
+                race_line = resample_closed_line(race_line, OUTPUT_POINTS)
     
             # Closing the loop to make the race line continuous
             loop_race_line = np.append(race_line, [race_line[0]], axis=0)
@@ -319,23 +410,26 @@ if page == "Original & Optimal Race Line Visualization":
             st.write(f"New race line length: {new_length:.2f}")
             st.write("## This is your Optimal Race Line")
     
-            # Plotting the track
-            fig, ax = plt.subplots(figsize=(16, 10), facecolor='black')
-            ax.set_aspect('equal')
-            ax.set_facecolor('black')  # Set the axes background color
-            fig.patch.set_facecolor('black')  # Set the figure background color
-            # Remove axis ticks
-            ax.tick_params(axis='both', colors='white')  # Make ticks white
-            # Set grid and labels with appropriate colors if necessary
-            ax.xaxis.label.set_color('white')
-            ax.yaxis.label.set_color('white')
-            ax.grid(True, which='both', color='gray', linestyle='--', linewidth=0.5)  # Optional grid
-            # Printing border and race line on the plot
-            print_border(ax, loop_race_line, inner_border, outer_border)
-            ax.set_title('Optimal Race Line', color='white', fontsize=20)
-            st.session_state.race_line_fig = fig
             st.session_state.loop_race_line = loop_race_line
-            st.pyplot(fig)
+            if RENDERER == "Interactive":
+                show_track_chart(waypoints, loop_race_line, title='Optimal Race Line', key="optimal_chart")
+            else:
+                # Plotting the track
+                fig, ax = plt.subplots(figsize=(16, 10), facecolor='black')
+                ax.set_aspect('equal')
+                ax.set_facecolor('black')  # Set the axes background color
+                fig.patch.set_facecolor('black')  # Set the figure background color
+                # Remove axis ticks
+                ax.tick_params(axis='both', colors='white')  # Make ticks white
+                # Set grid and labels with appropriate colors if necessary
+                ax.xaxis.label.set_color('white')
+                ax.yaxis.label.set_color('white')
+                ax.grid(True, which='both', color='gray', linestyle='--', linewidth=0.5)  # Optional grid
+                # Printing border and race line on the plot
+                print_border(ax, loop_race_line, inner_border, outer_border)
+                ax.set_title('Optimal Race Line', color='white', fontsize=20)
+                st.session_state.race_line_fig = fig
+                st.pyplot(fig)
             #st.pyplot(loop_race_line)
     
     
@@ -347,38 +441,184 @@ if page == "Original & Optimal Race Line Visualization":
                 file_name="optimal_track.npy",
                 mime="application/octet-stream"
             )
+            # Bundle with borders, speed (default speed settings, recorded in the bundle), curvature and heading as float32
+            st.download_button(
+                label="Download Race Line Bundle as .rlb",
+                data=race_line_bundle_bytes(race_line, inner_border, outer_border),
+                file_name=f"optimal_track.{BUNDLE_EXTENSION}",
+                mime="application/octet-stream"
+            )
+
+            # How the solve converged, pass by pass
+            if telemetry is not None and telemetry.count:
+                st.write("## Solver Telemetry")
+                columns = telemetry.columns()
+                st.markdown("- Displacement: How far the points moved in each iteration; near zero means converged")
+                st.line_chart({"max_displacement": columns["max_displacement"], "mean_displacement": columns["mean_displacement"]})
+                st.markdown("- Length and Maximum Curvature of the race line after each iteration")
+                st.line_chart({"length": columns["length"]})
+                st.line_chart({"max_curvature": columns["max_curvature"]})
+                st.markdown("- Points whose move was rejected by the border checks, and time per iteration")
+                st.line_chart({"rejected": columns["rejected"], "seconds": columns["seconds"]})
+                st.download_button(
+                    label="Download Telemetry as .csv",
+                    data=telemetry.to_csv(),
+                    file_name="solver_telemetry.csv",
+                    mime="text/csv"
+                )
+                st.download_button(
+                    label="Download Telemetry as .json",
+                    data=telemetry.to_json(),
+                    file_name="solver_telemetry.json",
+                    mime="application/json"
+                )
+
+        # Optional lookup grid so reward functions find the closest race line point in O(1)
+        if st.session_state.loop_race_line is not None and st.checkbox("Export a closest-point lookup grid for reward functions"):
+            st.markdown("- Grid Cell Size: Smaller cells lower the lookup error but use more memory")
+            GRID_CELL_SIZE = st.slider('Grid Cell Size', min_value=0.01, max_value=0.5, value=0.05, step=0.01)
+            GRID_MIN_SPEED = st.slider('Minimum Speed', min_value=0.1, max_value=4.0, value=1.5, step=0.1)
+            GRID_MAX_SPEED = st.slider('Maximum Speed', min_value=1.0, max_value=4.0, value=4.0, step=0.1)
+            lookup = closest_point_grid(st.session_state.loop_race_line[:-1], np.vstack([inner_border, outer_border]),
+                                        GRID_CELL_SIZE, GRID_MIN_SPEED, GRID_MAX_SPEED)
+            st.write(f"Grid of {lookup['shape'][0]} x {lookup['shape'][1]} cells, "
+                     f"{lookup['nbytes'] / 1024:.1f} KiB, worst-case error {lookup['max_error']:.3f}")
+            st.download_button(
+                label="Download Lookup Grid as .py",
+                data=lookup_grid_source(lookup),
+                file_name="race_line_lookup.py",
+                mime="text/x-python"
+            )
+
+        # Optional spline fit so reward functions carry a few control points instead of every race line point
+        if st.session_state.loop_race_line is not None and st.checkbox("Export a compressed spline race line for reward functions"):
+            st.markdown("- Maximum Error: Largest allowed distance between a race line point and the spline")
+            st.markdown("- Maximum Speed Error: Largest allowed difference between a point's speed, smoothed over its neighbours, and the spline")
+            SPLINE_MAX_ERROR = st.slider('Maximum Error', min_value=0.005, max_value=0.2, value=0.02, step=0.005, format="%.3f")
+            SPLINE_MAX_SPEED_ERROR = st.slider('Maximum Speed Error', min_value=0.01, max_value=1.0, value=0.1, step=0.01)
+            SPLINE_MIN_SPEED = st.slider('Minimum Speed', min_value=0.1, max_value=4.0, value=1.5, step=0.1, key="spline_min_speed")
+            SPLINE_MAX_SPEED = st.slider('Maximum Speed', min_value=1.0, max_value=4.0, value=4.0, step=0.1, key="spline_max_speed")
+            spline_race_line = st.session_state.loop_race_line[:-1]
+            spline_speed = batch_speed_profiles([spline_race_line], SPLINE_MIN_SPEED, SPLINE_MAX_SPEED, 0)[0][0]
+            spline = fit_race_line_spline(spline_race_line, spline_speed, SPLINE_MAX_ERROR, SPLINE_MAX_SPEED_ERROR)
+            st.write(f"{len(spline['control'])} position and {len(spline['speed_control'])} speed control points for "
+                     f"{spline['points']} race line points: {spline['compression_ratio']:.1f}x smaller, worst-case deviation "
+                     f"{spline['max_error']:.4f} in position and {spline['max_speed_error']:.3f} in speed")
+            if spline["max_error"] > SPLINE_MAX_ERROR or spline["max_speed_error"] > SPLINE_MAX_SPEED_ERROR:
+                st.warning("The spline could not meet the requested error; the deviation above is the best it reached.")
+            st.download_button(
+                label="Download Spline Race Line as .py",
+                data=race_line_spline_source(spline),
+                file_name="race_line_spline.py",
+                mime="text/x-python"
+            )
+
+        # Re-optimize (or lock) one section of the computed race line instead of the whole loop
+        if st.session_state.loop_race_line is not None and st.checkbox("Adjust a section of the race line"):
+            current_line = st.session_state.loop_race_line[:-1]
+            st.markdown("- Section Start and Length: Race line points to re-optimize, wrapping past the last point back to "
+                        "the first; every other point stays where it is")
+            st.markdown("- Lock Section: Keep the selected section fixed and re-optimize everything else instead")
+            SECTION_START = st.slider('Section Start', min_value=0, max_value=len(current_line) - 1, value=0)
+            SECTION_LENGTH = st.slider('Section Length', min_value=1, max_value=len(current_line) - 1,
+                                       value=min(21, len(current_line) - 1))
+            LOCK_SECTION = st.checkbox('Lock Section')
+            SECTION_ITERATIONS = st.slider('Section Line Iterations', min_value=10, max_value=1000, value=100, step=10)
+
+            if st.button('Re-optimize Section'):
+                indexes = section_indexes(len(current_line), SECTION_START, (SECTION_START + SECTION_LENGTH) % len(current_line))
+                if LOCK_SECTION:
+                    locked = set(indexes)
+                    indexes = [i for i in range(len(current_line)) if i not in locked]
+                section_status = st.empty()
+                # Runs in this script thread, but still takes a slot of the server-wide solver pool
+                with get_solve_job_manager().reserve(1, waiting=lambda: section_status.text("Waiting for free solvers...")):
+                    section_status.text("Re-optimizing section...")
+                    race_line = improve_race_line_section(current_line, inner_border, outer_border, indexes,
+                                                          SECTION_ITERATIONS, XI_ITERATIONS)
+                section_status.empty()
+                loop_race_line = np.append(race_line, [race_line[0]], axis=0)
+                st.session_state.loop_race_line = loop_race_line
+                st.write(f"Race line length: {LineString(np.append(current_line, [current_line[0]], axis=0)).length:.2f} "
+                         f"before, {LineString(loop_race_line).length:.2f} after")
+
+                if RENDERER == "Interactive":
+                    show_track_chart(waypoints, loop_race_line, title='Race Line with Re-optimized Section', key="section_chart")
+                else:
+                    fig, ax = plt.subplots(figsize=(16, 10), facecolor='black')
+                    ax.set_aspect('equal')
+                    ax.set_facecolor('black')
+                    fig.patch.set_facecolor('black')
+                    ax.tick_params(axis='both', colors='white')
+                    ax.grid(True, which='both', color='gray', linestyle='--', linewidth=0.5)
+                    print_border(ax, loop_race_line, inner_border, outer_border)
+                    moved = race_line[indexes]
+                    ax.plot(moved[:, 0], moved[:, 1], '.', color='orange', zorder=3)
+                    ax.set_title('Race Line with Re-optimized Section', color='white', fontsize=20)
+                    st.pyplot(fig)
+                st.download_button(
+                    label="Download Adjusted Race Line as .npy",
+                    data=create_download_link(loop_race_line),
+                    file_name="optimal_track.npy",
+                    mime="application/octet-stream"
+                )
 
 ################################################################
 elif page == "Optimal Speed Calculation":
     st.title("Optimal Speed Calculation")
     st.markdown("## Upload the Optimal Race Line (.npy) File to Calculate Speed Profile")
-    optimal_race_line_file = st.file_uploader("Upload your optimal race line file (.npy)", type="npy")
+    optimal_race_line_file = st.file_uploader("Upload your optimal race line file (.npy or .rlb bundle)", type=["npy", BUNDLE_EXTENSION])
+    racing_track = None
     if optimal_race_line_file is not None:
-        fpath = optimal_race_line_file
         TRACK_NAME = "optimal_track"
-        racing_track = np.load(fpath, allow_pickle=True).tolist()[:-1]
-        racing_track = [sublist[:2] for sublist in racing_track]
-    
-        LOOK_AHEAD_POINTS = st.slider('Look Ahead Points', min_value=0, max_value=20, value=0)
-        MIN_SPEED = st.slider('Minimum Speed', min_value=0.1, max_value=4.0, value=1.5, step=0.1)
-        MAX_SPEED = st.slider('Maximum Speed', min_value=1.0, max_value=4.0, value=4.0, step=0.1)
-
-    if st.button("Calculate Optimal Speed"):
-        velocity = optimal_velocity(track=racing_track, min_speed=MIN_SPEED, max_speed=MAX_SPEED, look_ahead_points=LOOK_AHEAD_POINTS)
-        
-        # Calculate distance to previous point
-        distance_to_prev = []
-        for i in range(len(racing_track)):
-            indexes = circle_indexes(racing_track, i, add_index_1=-1, add_index_2=0)[0:2]
-            coords = [racing_track[indexes[0]], racing_track[indexes[1]]]
-            dist_to_prev = dist_2_points(x1=coords[0][0], x2=coords[1][0], y1=coords[0][1], y2=coords[1][1])
-            distance_to_prev.append(dist_to_prev)
-        
-        # Calculate time to previous point
-        time_to_prev = [(distance_to_prev[i] / velocity[i]) for i in range(len(racing_track))]
-        
-        # Calculate total time
-        total_time = sum(time_to_prev)
+        try:
+            racing_track = decode_upload(optimal_race_line_file, "race_line")
+        except ValueError as e:
+            st.error(f"Could not read {optimal_race_line_file.name}: {e}")
+
+    if racing_track is not None:
+        # Start from the speed settings a bundle was saved with
+        speed_settings = (1.5, 4.0, 0)
+        if is_race_line_bundle(optimal_race_line_file.getvalue()):
+            speed_settings = load_race_line_bundle(optimal_race_line_file.getvalue())["speed_settings"] or speed_settings
+        LOOK_AHEAD_POINTS = st.slider('Look Ahead Points', min_value=0, max_value=20, value=int(speed_settings[2]))
+        MIN_SPEED = st.slider('Minimum Speed', min_value=0.1, max_value=4.0, value=round(speed_settings[0], 1), step=0.1)
+        MAX_SPEED = st.slider('Maximum Speed', min_value=1.0, max_value=4.0, value=round(speed_settings[1], 1), step=0.1)
+        st.markdown("- Number of Actions: Size of the discrete DeepRacer action space clustered from the speed profile")
+        NUM_ACTIONS = st.slider('Number of Actions', min_value=2, max_value=40, value=10)
+        WHEELBASE_LENGTH = st.number_input('Wheelbase', min_value=0.05, max_value=1.0, value=WHEELBASE, step=0.005, format="%.3f")
+
+        # Monte Carlo laps with tracking error, speed noise and a varying look-ahead
+        ROBUSTNESS = st.checkbox("Robustness Analysis")
+        if ROBUSTNESS:
+            st.markdown("- Samples: Number of perturbed laps simulated together")
+            st.markdown("- Lateral Noise: Standard deviation of the car's sideways distance from the race line, kept on the track")
+            st.markdown("- Speed Noise: Standard deviation of the car's speed relative to the planned speed")
+            st.markdown("- Look Ahead Spread: Each lap plans its speeds with a look-ahead up to this many points either side of the one above")
+            st.markdown("- Noise Smoothness: Distance along the race line, in metres, over which the noise changes")
+            ROBUSTNESS_SAMPLES = st.slider('Samples', min_value=100, max_value=5000, value=1000, step=100)
+            LATERAL_NOISE = st.slider('Lateral Noise', min_value=0.0, max_value=0.3, value=0.05, step=0.01)
+            SPEED_NOISE = st.slider('Speed Noise (%)', min_value=0, max_value=20, value=5)
+            LOOK_AHEAD_SPREAD = st.slider('Look Ahead Spread', min_value=0, max_value=5, value=2)
+            NOISE_SMOOTHNESS = st.slider('Noise Smoothness (m)', min_value=0.1, max_value=5.0, value=1.0, step=0.1)
+            if is_race_line_bundle(optimal_race_line_file.getvalue()):
+                bundle = load_race_line_bundle(optimal_race_line_file.getvalue())
+                robustness_borders = (bundle["inner_border"], bundle["outer_border"])
+            else:
+                robustness_track_file = st.file_uploader("Upload the track file (.npy) for off-track checks", type="npy")
+                robustness_borders = None
+                if robustness_track_file is not None:
+                    robustness_track = decode_upload(robustness_track_file)
+                    if robustness_track.ndim == 2 and robustness_track.shape[1] >= 6:
+                        robustness_borders = (robustness_track[:, 2:4], robustness_track[:, 4:6])
+                    else:
+                        st.error("The track file needs rows of center, inner and outer x/y.")
+
+    if racing_track is not None and st.button("Calculate Optimal Speed"):
+        # Speed, distance to previous point and total time, all as arrays
+        velocities, distances, lap_times = batch_speed_profiles([racing_track], MIN_SPEED, MAX_SPEED, LOOK_AHEAD_POINTS)
+        velocity = velocities[0]
+        total_time = lap_times[0]
         st.write(f"Total time for track, if racing line and speeds are followed perfectly: {total_time:.2f} seconds")
 
         # Plotting the speed profile
@@ -395,34 +635,223 @@ elif page == "Optimal Speed Calculation":
         st.write("## Calculated Optimal Speeds at Each Point:")
         st.write(velocity)
 
-        # Plotting the track with heatmap
-        fig, ax = plt.subplots(figsize=(16, 10), facecolor='black')
-        ax.set_aspect('equal')
-        ax.set_facecolor('black')
-        fig.patch.set_facecolor('black')
-        ax.tick_params(axis='both', colors='white')
-        ax.xaxis.label.set_color('white')
-        ax.yaxis.label.set_color('white')
-        ax.grid(True, which='both', color='gray', linestyle='--', linewidth=0.5)
-
-        # Define the colormap
-        cmap = plt.get_cmap('coolwarm')
-        norm = mcolors.Normalize(vmin=min(velocity), vmax=max(velocity))
-
-        for i in range(len(racing_track) - 1):
-            x = [racing_track[i][0], racing_track[i+1][0]]
-            y = [racing_track[i][1], racing_track[i+1][1]]
-            ax.plot(x, y, color=cmap(norm(velocity[i])), linewidth=3)
-            
-        ax.set_title('Heatmap of Optimal Race Line with Optimal Speed', color='white', fontsize=20)
-        st.pyplot(fig)
+        if RENDERER == "Interactive":
+            show_track_chart(race_line=racing_track, speed=velocity, title='Optimal Race Line with Optimal Speed', key="speed_chart")
+        else:
+            # Plotting the track with heatmap
+            fig, ax = plt.subplots(figsize=(16, 10), facecolor='black')
+            ax.set_aspect('equal')
+            ax.set_facecolor('black')
+            fig.patch.set_facecolor('black')
+            ax.tick_params(axis='both', colors='white')
+            ax.xaxis.label.set_color('white')
+            ax.yaxis.label.set_color('white')
+            ax.grid(True, which='both', color='gray', linestyle='--', linewidth=0.5)
 
+            # Define the colormap
+            cmap = plt.get_cmap('coolwarm')
+            norm = mcolors.Normalize(vmin=velocity.min(), vmax=velocity.max())
 
+            # One collection of segments instead of a plot call per segment
+            segments = np.stack([racing_track[:-1], racing_track[1:]], axis=1)
+            ax.add_collection(LineCollection(segments, colors=cmap(norm(velocity[:-1])), linewidths=3))
+            ax.autoscale_view()
 
+            ax.set_title('Heatmap of Optimal Race Line with Optimal Speed', color='white', fontsize=20)
+            st.pyplot(fig)
 
+        # Action space: steering from curvature and wheelbase, clustered with speed into discrete actions
+        actions, best_actions = race_line_action_space(racing_track, velocity, NUM_ACTIONS, WHEELBASE_LENGTH)
+        st.write("## Action Space")
+        st.dataframe(actions)
+        st.download_button(
+            label="Download Action Space as .json",
+            data=action_space_json(actions, best_actions),
+            file_name="action_space.json",
+            mime="application/json"
+        )
+
+        if ROBUSTNESS and robustness_borders is None:
+            st.warning("Upload the track file (or use a .rlb bundle) to run the robustness analysis.")
+        elif ROBUSTNESS:
+            robustness = robustness_analysis(racing_track, robustness_borders[0], robustness_borders[1], MIN_SPEED, MAX_SPEED,
+                                             LOOK_AHEAD_POINTS, ROBUSTNESS_SAMPLES, LATERAL_NOISE, SPEED_NOISE / 100,
+                                             LOOK_AHEAD_SPREAD, NOISE_SMOOTHNESS)
+            st.write("## Robustness Analysis")
+            percentiles = robustness["percentiles"]
+            st.write(f"Lap time over {ROBUSTNESS_SAMPLES} perturbed laps: median {percentiles[50]:.2f}s "
+                     f"(5%: {percentiles[5]:.2f}s, 95%: {percentiles[95]:.2f}s), mean {robustness['mean']:.2f}s "
+                     f"+- {robustness['std']:.2f}s against {robustness['nominal_lap_time']:.2f}s followed perfectly")
+            st.write(f"Laps that leave the track at least once: {100 * robustness['lap_off_track_probability']:.1f}%")
+
+            counts, edges = np.histogram(robustness["lap_times"], bins=30)
+            st.markdown("- Lap Time Distribution")
+            st.bar_chart({"lap time": np.round((edges[:-1] + edges[1:]) / 2, 2), "laps": counts}, x="lap time", y="laps")
+            st.markdown("- Off-Track Probability at Each Race Line Point")
+            st.line_chart({"off_track_probability": robustness["off_track_probability"]})
+            st.markdown("- Lap Time by Look Ahead Points")
+            st.dataframe([{"look_ahead_points": k, "lap_time": v} for k, v in robustness["look_ahead_lap_times"].items()])
+
+            st.markdown("- Corners, most fragile first: likeliest to go off track, then least predictable time")
+            st.dataframe(robustness["corners"])
+            fig, ax = plt.subplots(figsize=(16, 10), facecolor='black')
+            ax.set_aspect('equal')
+            ax.set_facecolor('black')
+            ax.tick_params(axis='both', colors='white')
+            ax.grid(True, which='both', color='gray', linestyle='--', linewidth=0.5)
+            for border in robustness_borders:
+                ax.plot(border[:, 0], border[:, 1], color='cyan', alpha=0.7, linewidth=1.5)
+            off_track = robustness["off_track_probability"]
+            segments = np.stack([racing_track, np.roll(racing_track, -1, axis=0)], axis=1)
+            ax.add_collection(LineCollection(segments, colors=plt.get_cmap('inferno')(off_track / max(off_track.max(), 1e-9)),
+                                             linewidths=3))
+            for rank, corner in enumerate(robustness["corners"][:3]):
+                x, y = racing_track[corner["start"]]
+                ax.annotate(f"{rank + 1}", (x, y), color='white', fontsize=16)
+            ax.autoscale_view()
+            ax.set_title('Off-Track Probability with the Most Fragile Corners', color='white', fontsize=20)
+            st.pyplot(fig)
 
+################################################################
+elif page == "Hyperparameter Sweep":
+    st.title("Hyperparameter Sweep")
+    st.markdown("- Solves the loaded track for every combination of the chosen values on a pool of worker processes.")
+    st.markdown("- Load a track on the Race Line Visualization page first.")
 
+    if 'sweep_rows' not in st.session_state:
+        st.session_state.sweep_rows = None
 
+    if 'sweep_race_lines' not in st.session_state:
+        st.session_state.sweep_race_lines = None
 
+    if st.session_state.get('waypoints') is None:
+        st.warning("No track loaded yet.")
+    else:
+        # Results of a sweep on another track do not apply to this one
+        sweep_track = track_digest(st.session_state.waypoints)
+        if st.session_state.get('sweep_track') != sweep_track:
+            st.session_state.sweep_rows = None
+            st.session_state.sweep_race_lines = None
+            st.session_state.sweep_track = sweep_track
+        speed_options = [round(0.1 * i, 1) for i in range(1, 41)]
+        SWEEP_LINE_ITERATIONS = st.multiselect('Number of Line Iterations', list(range(100, 2001, 100)), default=[100, 500])
+        SWEEP_XI_ITERATIONS = st.multiselect('Xi Iterations', list(range(3, 11)), default=[5])
+        SWEEP_MIN_SPEED = st.multiselect('Minimum Speed', speed_options, default=[1.5])
+        SWEEP_MAX_SPEED = st.multiselect('Maximum Speed', speed_options[9:], default=[4.0])
+        SWEEP_LOOK_AHEAD_POINTS = st.multiselect('Look Ahead Points', list(range(0, 21)), default=[0])
+        SWEEP_WORKERS = st.number_input('Parallel Workers', min_value=1, max_value=os.cpu_count() or 1, value=os.cpu_count() or 1)
+
+        if st.button('Run Sweep'):
+            progress_bar = st.progress(0)
+            status_text = st.empty()
 
+            def show_sweep_progress(done, total):
+                progress_bar.progress(int(100 * done / total))
+                status_text.text(f"Solved {done} of {total} race lines")
+
+            def wait_for_solvers():
+                status_text.text("Waiting for free solvers...")
+
+            # The sweep pool takes its workers from the server-wide solver slots
+            sweep_workers = min(SWEEP_WORKERS, max(1, len(SWEEP_LINE_ITERATIONS) * len(SWEEP_XI_ITERATIONS)))
+            with get_solve_job_manager().reserve(sweep_workers, waiting=wait_for_solvers) as workers:
+                rows, race_lines = run_sweep(st.session_state.waypoints, SWEEP_LINE_ITERATIONS, SWEEP_XI_ITERATIONS,
+                                             SWEEP_MIN_SPEED, SWEEP_MAX_SPEED, SWEEP_LOOK_AHEAD_POINTS,
+                                             workers=workers, progress=show_sweep_progress)
+            st.session_state.sweep_rows = rows
+            st.session_state.sweep_race_lines = race_lines
+            status_text.text("Sweep completed!")
+
+        if st.session_state.sweep_rows:
+            rows = st.session_state.sweep_rows
+            best = rows[0]
+            st.write(f"Best lap time {best['lap_time']:.2f}s with {best['line_iterations']} line iterations, "
+                     f"{best['xi_iterations']} xi iterations, speed {best['min_speed']}-{best['max_speed']}, "
+                     f"{best['look_ahead_points']} look ahead points")
+            st.dataframe(rows)
+            st.download_button(
+                label="Download Sweep Results as .csv",
+                data=sweep_to_csv(rows),
+                file_name="sweep_results.csv",
+                mime="text/csv"
+            )
+            best_race_line = st.session_state.sweep_race_lines[(best['line_iterations'], best['xi_iterations'])]
+            st.download_button(
+                label="Download Best Race Line as .npy",
+                data=create_download_link(np.append(best_race_line, [best_race_line[0]], axis=0)),
+                file_name="optimal_track.npy",
+                mime="application/octet-stream"
+            )
 
+################################################################
+elif page == "Race Line Leaderboard":
+    st.title("Race Line Leaderboard")
+    st.markdown("- Upload several optimal race line (.npy or .rlb) files, or give a folder on the server, to rank them by lap time.")
+
+    race_line_files = st.file_uploader("Upload your optimal race line files (.npy or .rlb bundle)", type=["npy", BUNDLE_EXTENSION],
+                                       accept_multiple_files=True)
+    # Server folders are only offered below a root directory set by whoever runs the server
+    race_line_root = os.environ.get("RACE_LINE_ROOT")
+    race_line_folder = ""
+    if race_line_root:
+        race_line_root = os.path.realpath(race_line_root)
+        race_line_folder = st.text_input(f"Or a folder of race line files under {race_line_root} on the server", value="")
+
+    LOOK_AHEAD_POINTS = st.slider('Look Ahead Points', min_value=0, max_value=20, value=0)
+    MIN_SPEED = st.slider('Minimum Speed', min_value=0.1, max_value=4.0, value=1.5, step=0.1)
+    MAX_SPEED = st.slider('Maximum Speed', min_value=1.0, max_value=4.0, value=4.0, step=0.1)
+    TOP_CANDIDATES = st.slider('Race Lines to Overlay', min_value=1, max_value=10, value=3)
+
+    if st.button("Rank Race Lines"):
+        race_lines = {}
+
+        def add_race_line(name, load):
+            # One unreadable file is skipped with a warning; duplicate names get a numbered suffix
+            try:
+                line = load()
+            except Exception as e:
+                st.warning(f"Skipped {name}: {e}")
+                return
+            unique_name, copy_number = name, 2
+            while unique_name in race_lines:
+                unique_name, copy_number = f"{name} ({copy_number})", copy_number + 1
+            race_lines[unique_name] = line
+
+        for f in race_line_files or []:
+            add_race_line(f.name, lambda f=f: decode_upload(f, "race_line"))
+        if race_line_folder:
+            folder = os.path.realpath(os.path.join(race_line_root, race_line_folder))
+            paths = []
+            if os.path.commonpath([folder, race_line_root]) != race_line_root:
+                st.error(f"The folder must be inside {race_line_root}.")
+            else:
+                paths = glob.glob(os.path.join(folder, "*.npy")) + glob.glob(os.path.join(folder, f"*.{BUNDLE_EXTENSION}"))
+            for path in sorted(paths):
+                if os.path.commonpath([os.path.realpath(path), race_line_root]) != race_line_root:
+                    st.warning(f"Skipped {os.path.basename(path)}: outside {race_line_root}")
+                    continue
+                add_race_line(os.path.basename(path), lambda path=path: load_race_line(path))
+
+        if not race_lines:
+            st.warning("No race line files given.")
+        else:
+            rows, velocities = race_line_leaderboard(race_lines, MIN_SPEED, MAX_SPEED, LOOK_AHEAD_POINTS)
+            st.write(f"Fastest: {rows[0]['name']} with {rows[0]['lap_time']:.2f} seconds")
+            st.dataframe(rows)
+
+            # Overlay the fastest candidates
+            fig, ax = plt.subplots(figsize=(16, 10), facecolor='black')
+            ax.set_aspect('equal')
+            ax.set_facecolor('black')
+            fig.patch.set_facecolor('black')
+            ax.tick_params(axis='both', colors='white')
+            ax.grid(True, which='both', color='gray', linestyle='--', linewidth=0.5)
+            cmap = plt.get_cmap('tab10')
+            for rank, row in enumerate(rows[:TOP_CANDIDATES]):
+                line = race_lines[row['name']]
+                line = np.append(line, [line[0]], axis=0)
+                ax.plot(line[:, 0], line[:, 1], color=cmap(rank), linewidth=2,
+                        label=f"{rank + 1}. {row['name']} ({row['lap_time']:.2f}s)")
+            ax.legend(facecolor='black', labelcolor='white')
+            ax.set_title('Fastest Race Lines', color='white', fontsize=20)
+            st.pyplot(fig)
@@ -0,0 +1,64 @@
+import json
+
+import numpy as np
+
+from race_line import line_curvature
+
+# AWS DeepRacer car geometry and steering limit
+WHEELBASE = 0.165
+MAX_STEERING_ANGLE = 30.0
+
+
+def steering_angles(race_line, wheelbase=WHEELBASE, max_steering_angle=MAX_STEERING_ANGLE):
+    '''Bicycle-model steering angle in degrees (positive = left) needed at every point of a closed race line'''
+    angles = np.degrees(np.arctan(wheelbase * line_curvature(race_line, signed=True)))
+    return np.clip(angles, -max_steering_angle, max_steering_angle)
+
+
+def kmeans(points, k, iterations=50, seed=0):
+    '''Vectorized k-means with k-means++ seeding; returns (centres, label per point)'''
+    points = np.asarray(points, dtype=np.float64)
+    k = min(k, len(np.unique(points, axis=0)))
+    rng = np.random.default_rng(seed)
+    centres = points[[rng.integers(len(points))]]
+    for _ in range(1, k):
+        dist = ((points[:, None, :] - centres[None, :, :]) ** 2).sum(axis=2).min(axis=1)
+        centres = np.vstack([centres, points[rng.choice(len(points), p=dist / dist.sum())]])
+
+    labels = np.zeros(len(points), dtype=np.int64)
+    for i in range(iterations):
+        new_labels = ((points[:, None, :] - centres[None, :, :]) ** 2).sum(axis=2).argmin(axis=1)
+        if i and np.array_equal(new_labels, labels):
+            break
+        labels = new_labels
+        counts = np.bincount(labels, minlength=k)
+        for dim in range(points.shape[1]):
+            sums = np.bincount(labels, weights=points[:, dim], minlength=k)
+            # Empty clusters keep their previous centre
+            np.divide(sums, counts, out=centres[:, dim], where=counts > 0)
+    return centres, labels
+
+
+def race_line_action_space(race_line, velocity, num_actions, wheelbase=WHEELBASE, max_steering_angle=MAX_STEERING_ANGLE):
+    '''Discrete (steering, speed) actions clustered from the race line; returns (actions, best action per point)'''
+    steering = steering_angles(race_line, wheelbase, max_steering_angle)
+    velocity = np.asarray(velocity, dtype=np.float64)
+    pairs = np.column_stack([steering, velocity])
+    # Cluster on comparable scales so neither steering nor speed dominates the distance
+    scale = np.ptp(pairs, axis=0)
+    scale[scale == 0] = 1.0
+    centres, labels = kmeans(pairs / scale, num_actions)
+    centres = centres * scale
+
+    # Number actions from hard left to hard right, slow to fast, like the DeepRacer console
+    order = np.lexsort((centres[:, 1], -centres[:, 0]))
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    actions = [{"steering_angle": round(float(angle), 1), "speed": round(float(speed), 2), "index": i}
+               for i, (angle, speed) in enumerate(centres[order])]
+    return actions, rank[labels]
+
+
+def action_space_json(actions, best_actions):
+    '''Action space in model_metadata.json layout plus the best action index for every race line point'''
+    return json.dumps({"action_space": actions, "race_line_action_index": [int(a) for a in best_actions]})
@@ -0,0 +1,101 @@
+import itertools
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
+
+import numpy as np
+from shapely.geometry import LineString, Polygon
+
+from race_line import improve_points
+from speed_profile import optimal_velocity, lap_time
+
+SWEEP_COLUMNS = ["line_iterations", "xi_iterations", "min_speed", "max_speed", "look_ahead_points",
+                 "race_line_length", "lap_time", "runtime"]
+
+_worker_state = {}
+
+
+def _init_sweep_worker(name, shape):
+    shm = shared_memory.SharedMemory(name=name)
+    waypoints = np.ndarray(shape, dtype=np.float64, buffer=shm.buf)
+    _worker_state['shm'] = shm
+    _worker_state['center_line'] = waypoints[:, 0:2]
+    _worker_state['inner'] = Polygon(waypoints[:, 2:4])
+    _worker_state['outer'] = Polygon(waypoints[:, 4:6])
+
+
+def _run_solve(line_iterations, xi_iterations, speed_settings):
+    '''Solve one (line_iterations, xi_iterations) pair and score it under every speed setting'''
+    start = time.perf_counter()
+    race_line = np.array(_worker_state['center_line'][:-1])
+    for _ in range(line_iterations):
+        improve_points(race_line, range(len(race_line)), _worker_state['inner'], _worker_state['outer'], xi_iterations)
+    solve_time = time.perf_counter() - start
+    length = LineString(np.append(race_line, [race_line[0]], axis=0)).length
+
+    rows = []
+    for min_speed, max_speed, look_ahead_points in speed_settings:
+        speed_start = time.perf_counter()
+        velocity = optimal_velocity(race_line, min_speed, max_speed, look_ahead_points)
+        rows.append({
+            "line_iterations": line_iterations,
+            "xi_iterations": xi_iterations,
+            "min_speed": min_speed,
+            "max_speed": max_speed,
+            "look_ahead_points": look_ahead_points,
+            "race_line_length": length,
+            "lap_time": lap_time(race_line, velocity),
+            "runtime": solve_time + time.perf_counter() - speed_start,
+        })
+    return race_line, rows
+
+
+def run_sweep(waypoints, line_iterations, xi_iterations, min_speeds, max_speeds, look_ahead_points,
+              workers=None, progress=None):
+    '''Solve every combination of the given hyperparameter values on a process pool.
+
+    Each (line_iterations, xi_iterations) pair is solved once and then scored for every
+    speed setting, since the speed settings do not change the race line. Combinations
+    with min_speed > max_speed are skipped. Returns (rows sorted by lap time, race lines
+    keyed by (line_iterations, xi_iterations)); progress(done, total) is called per solve.
+    '''
+    waypoints = np.ascontiguousarray(waypoints, dtype=np.float64)
+    speed_settings = [(lo, hi, ahead) for lo, hi, ahead in itertools.product(min_speeds, max_speeds, look_ahead_points)
+                      if lo <= hi]
+    solves = list(itertools.product(line_iterations, xi_iterations))
+    if not solves or not speed_settings:
+        return [], {}
+
+    shm = shared_memory.SharedMemory(create=True, size=waypoints.nbytes)
+    shared = np.ndarray(waypoints.shape, dtype=np.float64, buffer=shm.buf)
+    shared[:] = waypoints
+    rows = []
+    race_lines = {}
+    try:
+        workers = min(workers or os.cpu_count() or 1, len(solves))
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_sweep_worker,
+                                 initargs=(shm.name, waypoints.shape)) as pool:
+            # Longest solves first so they do not end up as the tail of the batch
+            futures = {pool.submit(_run_solve, lines, xi, speed_settings): (lines, xi)
+                       for lines, xi in sorted(solves, key=lambda s: -s[0] * s[1])}
+            for done, future in enumerate(as_completed(futures), start=1):
+                race_line, solve_rows = future.result()
+                race_lines[futures[future]] = race_line
+                rows.extend(solve_rows)
+                if progress is not None:
+                    progress(done, len(solves))
+    finally:
+        del shared
+        shm.close()
+        shm.unlink()
+    rows.sort(key=lambda row: row["lap_time"])
+    return rows, race_lines
+
+
+def sweep_to_csv(rows):
+    '''Render sweep rows as CSV text'''
+    lines = [",".join(SWEEP_COLUMNS)]
+    for row in rows:
+        lines.append(",".join(str(row[column]) for column in SWEEP_COLUMNS))
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,178 @@
+import numpy as np
+
+from speed_profile import batch_speed_profiles, circle_radii
+
+# Border points matched to race line points this many race line points at a time to bound memory
+ROOM_CHUNK_POINTS = 256
+# Perturbed laps are simulated in chunks of about this many (sample, point) values to bound memory
+ROBUSTNESS_CHUNK_VALUES = 250000
+# Distance either side of a point over which the grip-limiting radius of a perturbed path is measured
+GRIP_STENCIL_LENGTH = 0.25
+
+
+def line_normals(line):
+    '''Unit normal pointing left of the direction of travel at every point of a closed line'''
+    tangent = np.roll(line, -1, axis=0) - np.roll(line, 1, axis=0)
+    tangent /= np.maximum(np.linalg.norm(tangent, axis=1, keepdims=True), 1e-12)
+    return np.column_stack([-tangent[:, 1], tangent[:, 0]])
+
+
+def _closest_on_border(points, border):
+    # Closest point on a closed border polyline to each of points
+    start = border
+    step = np.roll(border, -1, axis=0) - border
+    length2 = np.maximum((step ** 2).sum(axis=1), 1e-12)
+    closest = np.empty_like(points)
+    for first in range(0, len(points), ROOM_CHUNK_POINTS):
+        chunk = points[first:first + ROOM_CHUNK_POINTS, None, :]
+        t = np.clip(((chunk - start) * step).sum(axis=2) / length2, 0.0, 1.0)
+        candidates = start + t[:, :, None] * step
+        nearest = ((candidates - chunk) ** 2).sum(axis=2).argmin(axis=1)
+        closest[first:first + len(chunk)] = candidates[np.arange(len(chunk)), nearest]
+    return closest
+
+
+def lateral_room(race_line, inner_border, outer_border):
+    '''How far each race line point can move left and right before it leaves the track, as (left, right)'''
+    race_line = np.asarray(race_line, dtype=np.float64)[:, :2]
+    normals = line_normals(race_line)
+    left = np.full(len(race_line), np.inf)
+    right = np.full(len(race_line), np.inf)
+    for border in (inner_border, outer_border):
+        border = np.asarray(border, dtype=np.float64)[:, :2]
+        offset = _closest_on_border(race_line, border) - race_line
+        distance = np.linalg.norm(offset, axis=1)
+        on_left = (offset * normals).sum(axis=1) >= 0
+        left = np.where(on_left, np.minimum(left, distance), left)
+        right = np.where(on_left, right, np.minimum(right, distance))
+    return left, right
+
+
+def smooth_noise(rng, samples, npoints, std, correlation_points):
+    '''(samples, npoints) Gaussian noise around each closed lap, smoothed over about correlation_points points'''
+    if std <= 0:
+        return np.zeros((samples, npoints))
+    noise = rng.standard_normal((samples, npoints))
+    if correlation_points > 0:
+        frequency = np.fft.rfftfreq(npoints)
+        kernel = np.exp(-0.5 * (2 * np.pi * frequency * correlation_points) ** 2)
+        noise = np.fft.irfft(np.fft.rfft(noise, axis=1) * kernel, npoints, axis=1)
+    return noise * (std / max(noise.std(), 1e-12))
+
+
+def _corners(nominal_speed, max_speed):
+    # (start, stop) index runs, wrapping round the lap, where the planned speed is held below max_speed
+    slow = nominal_speed < max_speed - 1e-9
+    if slow.all() or not slow.any():
+        return [(0, len(slow))]
+    first_fast = int(np.argmin(slow))
+    order = np.roll(np.arange(len(slow)), -first_fast)
+    edges = np.flatnonzero(np.diff(slow[order].astype(np.int8)))
+    runs = []
+    for begin, end in zip(edges[::2] + 1, edges[1::2] + 1):
+        runs.append((int(order[begin]), int(order[begin]) + end - begin))
+    if len(edges) % 2:
+        runs.append((int(order[edges[-1] + 1]), int(order[edges[-1] + 1]) + len(slow) - edges[-1] - 1))
+    return runs
+
+
+def robustness_analysis(race_line, inner_border, outer_border, min_speed, max_speed, look_ahead_points,
+                        samples=1000, lateral_std=0.05, speed_std=0.05, look_ahead_spread=2,
+                        correlation_length=1.0, seed=0):
+    '''Monte Carlo lap times of a closed race line (without its closing point) under tracking error.
+
+    Every sample drives the line with a smooth lateral offset (std lateral_std, clamped to the
+    track; clamped points count as off track), the planned speed scaled by smooth noise of
+    relative std speed_std, and a look-ahead drawn from look_ahead_points +- look_ahead_spread.
+    The noise changes over about correlation_length metres of the line. Where the offset path
+    is tighter than planned the car slows to what the grip allows there, with path radii
+    measured over GRIP_STENCIL_LENGTH metres, so the result does not depend on how densely the
+    line is sampled. Samples are evaluated as (samples, N) arrays, ROBUSTNESS_CHUNK_VALUES at a time.
+    '''
+    race_line = np.asarray(race_line, dtype=np.float64)[:, :2]
+    npoints = len(race_line)
+    rng = np.random.default_rng(seed)
+    spacing = np.linalg.norm(race_line - np.roll(race_line, 1, axis=0), axis=1).mean()
+    correlation_points = correlation_length / max(spacing, 1e-9)
+    stencil = max(1, int(round(GRIP_STENCIL_LENGTH / max(spacing, 1e-9))))
+
+    look_aheads = np.arange(max(0, look_ahead_points - look_ahead_spread), look_ahead_points + look_ahead_spread + 1)
+    # Planned speed for each look-ahead a sample may use; batch_speed_profiles takes one look-ahead per call
+    profiles = []
+    for look_ahead in look_aheads:
+        velocity, _, lap_time = batch_speed_profiles([race_line], min_speed, max_speed, int(look_ahead))
+        profiles.append((velocity[0], float(lap_time[0])))
+    planned = np.array([velocity for velocity, _ in profiles])
+    nominal_index = int(np.flatnonzero(look_aheads == look_ahead_points)[0])
+    nominal_speed = planned[nominal_index]
+
+    left, right = lateral_room(race_line, inner_border, outer_border)
+    normals = line_normals(race_line)
+    # Grip limit of the offset paths, with the same scaling that puts the nominal tightest corner at min_speed
+    nominal_radius = circle_radii(race_line, np.roll(np.arange(npoints), stencil), np.roll(np.arange(npoints), -stencil))
+    grip_scale = min_speed / nominal_radius.min() ** 0.5
+    corner_runs = _corners(nominal_speed, max_speed)
+    corner_indexes = [np.arange(start, stop) % npoints for start, stop in corner_runs]
+
+    lap_times = np.empty(samples)
+    lap_off_track = np.empty(samples, dtype=bool)
+    off_track_count = np.zeros(npoints)
+    segment_sum = np.zeros(npoints)
+    segment_square_sum = np.zeros(npoints)
+    corner_times = [np.empty(samples) for _ in corner_runs]
+    corner_off_track = [np.empty(samples, dtype=bool) for _ in corner_runs]
+    chunk_samples = max(1, ROBUSTNESS_CHUNK_VALUES // npoints)
+    for first in range(0, samples, chunk_samples):
+        count = min(chunk_samples, samples - first)
+        done = slice(first, first + count)
+        offset = smooth_noise(rng, count, npoints, lateral_std, correlation_points)
+        off_track = (offset > left) | (offset < -right)
+        offset = np.clip(offset, -right, left)
+        paths = race_line + offset[:, :, None] * normals
+
+        flat = np.arange(count * npoints).reshape(count, npoints)
+        radius = circle_radii(paths.reshape(-1, 2), np.roll(flat, stencil, axis=1).ravel(),
+                              np.roll(flat, -stencil, axis=1).ravel())
+        grip_speed = grip_scale * radius.reshape(count, npoints) ** 0.5
+
+        chosen = rng.integers(0, len(look_aheads), count)
+        speed = planned[chosen] * np.maximum(1 + smooth_noise(rng, count, npoints, speed_std, correlation_points), 0.1)
+        speed = np.minimum(speed, np.maximum(grip_speed, min_speed))
+        segment_times = np.linalg.norm(paths - np.roll(paths, 1, axis=1), axis=2) / speed
+
+        lap_times[done] = segment_times.sum(axis=1)
+        lap_off_track[done] = off_track.any(axis=1)
+        off_track_count += off_track.sum(axis=0)
+        segment_sum += segment_times.sum(axis=0)
+        segment_square_sum += (segment_times ** 2).sum(axis=0)
+        for times, leaves, indexes in zip(corner_times, corner_off_track, corner_indexes):
+            times[done] = segment_times[:, indexes].sum(axis=1)
+            leaves[done] = off_track[:, indexes].any(axis=1)
+
+    segment_mean = segment_sum / samples
+    nominal_segment_times = np.linalg.norm(race_line - np.roll(race_line, 1, axis=0), axis=1) / nominal_speed
+    corners = []
+    for (start, stop), indexes, times, leaves in zip(corner_runs, corner_indexes, corner_times, corner_off_track):
+        corners.append({
+            "start": int(start),
+            "end": int((stop - 1) % npoints),
+            "min_speed": float(nominal_speed[indexes].min()),
+            "off_track_probability": float(leaves.mean()),
+            "mean_time_loss": float(times.mean() - nominal_segment_times[indexes].sum()),
+            "time_std": float(times.std()),
+        })
+    # Most fragile first: likeliest to leave the track, then least predictable time
+    corners.sort(key=lambda corner: (-corner["off_track_probability"], -corner["time_std"]))
+
+    return {
+        "lap_times": lap_times,
+        "nominal_lap_time": profiles[nominal_index][1],
+        "percentiles": {p: float(np.percentile(lap_times, p)) for p in (5, 50, 95)},
+        "mean": float(lap_times.mean()),
+        "std": float(lap_times.std()),
+        "off_track_probability": off_track_count / samples,
+        "lap_off_track_probability": float(lap_off_track.mean()),
+        "segment_time_std": np.sqrt(np.maximum(segment_square_sum / samples - segment_mean ** 2, 0.0)),
+        "corners": corners,
+        "look_ahead_lap_times": {int(look_ahead): lap_time for look_ahead, (_, lap_time) in zip(look_aheads, profiles)},
+    }
@@ -0,0 +1,45 @@
+import time
+
+import numpy as np
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+# Seconds between preview frames while a solve is running
+PREVIEW_INTERVAL = 0.5
+
+
+class RaceLinePreview:
+    '''Cheap live view of a race line during a solve.
+
+    The borders are drawn once into a cached background image; each frame only restores
+    that image and draws the race line on top of it, and frames closer together than
+    min_interval seconds are skipped.
+    '''
+
+    def __init__(self, inner_border, outer_border, min_interval=PREVIEW_INTERVAL, figsize=(8, 5), dpi=80):
+        self.min_interval = min_interval
+        self.last_frame = 0.0
+        self.fig = Figure(figsize=figsize, dpi=dpi, facecolor='black')
+        self.canvas = FigureCanvasAgg(self.fig)
+        self.ax = self.fig.add_subplot()
+        self.ax.set_aspect('equal')
+        self.ax.set_facecolor('black')
+        self.ax.axis('off')
+        for border in (inner_border, outer_border):
+            border = np.asarray(border)
+            self.ax.plot(border[:, 0], border[:, 1], color='cyan', alpha=0.7, linewidth=1.5)
+        self.line, = self.ax.plot([], [], color='orange', linewidth=2, animated=True)
+        self.canvas.draw()
+        self.background = self.canvas.copy_from_bbox(self.fig.bbox)
+
+    def render(self, race_line, force=False):
+        '''RGBA frame of the borders plus race_line, or None if the last frame was too recent'''
+        now = time.perf_counter()
+        if not force and now - self.last_frame < self.min_interval:
+            return None
+        self.last_frame = now
+        race_line = np.asarray(race_line)
+        self.canvas.restore_region(self.background)
+        self.line.set_data(np.append(race_line[:, 0], race_line[0, 0]), np.append(race_line[:, 1], race_line[0, 1]))
+        self.ax.draw_artist(self.line)
+        return np.array(self.canvas.buffer_rgba())
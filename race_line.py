@@ -0,0 +1,300 @@
+import copy
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+from shapely.geometry import Polygon, Point
+
+# improve_points looks two points either side of the point it moves
+HALO_POINTS = 2
+# Below this many points per segment the process overhead outweighs the work
+MIN_SEGMENT_POINTS = 16
+
+
+def menger_curvature(pt1, pt2, pt3, atol=1e-3):
+    vec21 = np.array(pt1) - np.array(pt2)
+    vec23 = np.array(pt3) - np.array(pt2)
+    norm21 = np.linalg.norm(vec21)
+    norm23 = np.linalg.norm(vec23)
+    theta = np.arccos(np.dot(vec21, vec23) / (norm21 * norm23))
+    if np.isclose(theta - np.pi, 0.0, atol=atol):
+        theta = 0.0
+    dist13 = np.linalg.norm(np.array(pt1) - np.array(pt3))
+    return 2 * np.sin(theta) / dist13 if dist13 != 0 else 0
+
+
+def improve_points(new_line, indexes, ls_inner_border, ls_outer_border, xi_iterations):
+    '''Move each point in indexes, in order and in place, towards the mean curvature of its neighbours.
+
+    Returns how many of the points had a candidate position rejected by the border checks.
+    '''
+    npoints = len(new_line)
+    rejected = 0
+    for i in indexes:
+        hit_border = False
+        xi = new_line[i]
+        prevprev = (i - 2 + npoints) % npoints
+        prev = (i - 1 + npoints) % npoints
+        nexxt = (i + 1 + npoints) % npoints
+        nexxtnexxt = (i + 2 + npoints) % npoints
+        #print("%d: %d %d %d %d %d" % (npoints, prevprev, prev, i, nexxt, nexxtnexxt))
+        ci = menger_curvature(new_line[prev], xi, new_line[nexxt])
+        c1 = menger_curvature(new_line[prevprev], new_line[prev], xi)
+        c2 = menger_curvature(xi, new_line[nexxt], new_line[nexxtnexxt])
+        target_ci = (c1 + c2) / 2
+        #print("i %d ci %f target_ci %f c1 %f c2 %f" % (i, ci, target_ci, c1, c2))
+
+        # Calculate prospective new track position, start at half-way (curvature zero)
+        xi_bound1 = copy.deepcopy(xi)
+        xi_bound2 = ((new_line[nexxt][0] + new_line[prev][0]) / 2.0, (new_line[nexxt][1] + new_line[prev][1]) / 2.0)
+        p_xi = copy.deepcopy(xi)
+        for j in range(0,xi_iterations):
+            p_ci = menger_curvature(new_line[prev], p_xi, new_line[nexxt])
+            #print("i: {} iter {} p_ci {} p_xi {} b1 {} b2 {}".format(i,j,p_ci,p_xi,xi_bound1, xi_bound2))
+            if np.isclose(p_ci, target_ci):
+                break
+            if p_ci < target_ci:
+                # too flat, shrinking track too much
+                xi_bound2 = copy.deepcopy(p_xi)
+                new_p_xi = ((xi_bound1[0] + p_xi[0]) / 2.0, (xi_bound1[1] + p_xi[1]) / 2.0)
+                if Point(new_p_xi).within(ls_inner_border) or not Point(new_p_xi).within(ls_outer_border):
+                    xi_bound1 = copy.deepcopy(new_p_xi)
+                    hit_border = True
+                else:
+                    p_xi = new_p_xi
+            else:
+                # too curved, flatten it out
+                xi_bound1 = copy.deepcopy(p_xi)
+                new_p_xi = ((xi_bound2[0] + p_xi[0]) / 2.0, (xi_bound2[1] + p_xi[1]) / 2.0)
+
+                # If iteration pushes the point beyond the border of the track,
+                # just abandon the refinement at this point.  As adjacent
+                # points are adjusted within the track the point should gradually
+                # make its way to a new position.  A better way would be to use
+                # a projection of the point on the border as the new bound.  Later.
+                if Point(new_p_xi).within(ls_inner_border) or not Point(new_p_xi).within(ls_outer_border):
+                    xi_bound2 = copy.deepcopy(new_p_xi)
+                    hit_border = True
+                else:
+                    p_xi = new_p_xi
+        new_xi = p_xi
+        # New point which has mid-curvature of prev and next points but may be outside of track
+        #print((new_line[i], new_xi))
+        new_line[i] = new_xi
+        rejected += hit_border
+    return rejected
+
+
+def section_indexes(npoints, start, stop):
+    '''Indexes from start up to (not including) stop on a closed loop, wrapping past the end if stop <= start'''
+    return list(range(start, stop)) if start < stop else list(range(start, npoints)) + list(range(0, stop))
+
+
+def improve_race_line_section(race_line, inner_border, outer_border, indexes, line_iterations, xi_iterations=5):
+    '''Run line_iterations passes that only move the points in indexes; every other point stays pinned'''
+    new_line = np.array(race_line, dtype=np.float64)
+    ls_inner_border = Polygon(inner_border)
+    ls_outer_border = Polygon(outer_border)
+    indexes = list(dict.fromkeys(indexes))
+    for _ in range(line_iterations):
+        improve_points(new_line, indexes, ls_inner_border, ls_outer_border, xi_iterations)
+    return new_line
+
+#####################################################################
+# Domain decomposition: every worker owns a contiguous segment of the loop
+# and reads HALO_POINTS neighbours either side from the previous exchange.
+# The line is double buffered in shared memory so only segment bounds
+# travel through the pool on each pass.
+
+_worker_state = {}
+
+
+def _init_segment_worker(buffer_names, npoints, inner_border, outer_border):
+    buffers = [shared_memory.SharedMemory(name=name) for name in buffer_names]
+    _worker_state['buffers'] = buffers
+    _worker_state['lines'] = [np.ndarray((npoints, 2), dtype=np.float64, buffer=b.buf) for b in buffers]
+    _worker_state['inner'] = Polygon(inner_border)
+    _worker_state['outer'] = Polygon(outer_border)
+
+
+def _solve_segment(start, stop, src, passes, xi_iterations):
+    lines = _worker_state['lines']
+    npoints = len(lines[src])
+    # Segment plus halo, unwrapped so the local copy never needs to wrap around
+    local = lines[src][np.arange(start - HALO_POINTS, stop + HALO_POINTS) % npoints]
+    owned = range(HALO_POINTS, HALO_POINTS + stop - start)
+    rejected = 0
+    for _ in range(passes):
+        rejected += improve_points(local, owned, _worker_state['inner'], _worker_state['outer'], xi_iterations)
+    lines[1 - src][start:stop] = local[HALO_POINTS:HALO_POINTS + stop - start]
+    return rejected
+
+
+def segment_bounds(npoints, workers):
+    '''Split a closed loop of npoints into contiguous (start, stop) segments, one per worker'''
+    workers = max(1, min(workers, npoints // MIN_SEGMENT_POINTS))
+    edges = np.linspace(0, npoints, workers + 1).astype(int)
+    return list(zip(edges[:-1], edges[1:]))
+
+
+def parallel_improve_race_line(race_line, inner_border, outer_border, line_iterations, xi_iterations=5,
+                               workers=2, exchange_every=1, progress=None, preview=None, telemetry=None):
+    '''Run line_iterations improve_points passes over the whole line split across worker processes.
+
+    Halo points are exchanged every exchange_every passes; progress(passes_done) and
+    preview(current_line) are called, and a telemetry row recorded, after each exchange.
+    '''
+    race_line = np.asarray(race_line, dtype=np.float64)
+    npoints = len(race_line)
+    bounds = segment_bounds(npoints, workers)
+    if len(bounds) == 1:
+        ls_inner_border = Polygon(inner_border)
+        ls_outer_border = Polygon(outer_border)
+        for i in range(line_iterations):
+            pass_start = time.perf_counter()
+            old_line = race_line
+            race_line = race_line.copy()
+            rejected = improve_points(race_line, range(npoints), ls_inner_border, ls_outer_border, xi_iterations)
+            if telemetry is not None:
+                telemetry.record(old_line, race_line, rejected, time.perf_counter() - pass_start)
+            if progress is not None:
+                progress(i + 1)
+            if preview is not None:
+                preview(race_line)
+        return race_line
+
+    buffers = [shared_memory.SharedMemory(create=True, size=race_line.nbytes) for _ in range(2)]
+    lines = [np.ndarray(race_line.shape, dtype=np.float64, buffer=b.buf) for b in buffers]
+    try:
+        lines[0][:] = race_line
+        src = 0
+        done = 0
+        with ProcessPoolExecutor(max_workers=len(bounds), initializer=_init_segment_worker,
+                                 initargs=([b.name for b in buffers], npoints,
+                                           np.asarray(inner_border), np.asarray(outer_border))) as pool:
+            while done < line_iterations:
+                passes = min(exchange_every, line_iterations - done)
+                round_start = time.perf_counter()
+                futures = [pool.submit(_solve_segment, start, stop, src, passes, xi_iterations)
+                           for start, stop in bounds]
+                rejected = sum(future.result() for future in futures)
+                if telemetry is not None:
+                    telemetry.record(lines[src], lines[1 - src], rejected, time.perf_counter() - round_start, passes)
+                src = 1 - src
+                done += passes
+                if progress is not None:
+                    progress(done)
+                if preview is not None:
+                    preview(lines[src])
+        return lines[src].copy()
+    finally:
+        # Views must be released before the shared memory can be closed
+        lines.clear()
+        for b in buffers:
+            b.close()
+            b.unlink()
+
+#####################################################################
+# Vectorized measures of a closed line, cheap enough to evaluate every pass
+
+def line_segment_lengths(line):
+    '''Distance from every point of a closed line to the previous one'''
+    line = np.asarray(line, dtype=np.float64)
+    return np.linalg.norm(line - np.roll(line, 1, axis=0), axis=1)
+
+
+def line_curvature(line, signed=False):
+    '''Menger curvature at every point of a closed line; signed curvature is positive on left turns'''
+    line = np.asarray(line, dtype=np.float64)
+    prev = np.roll(line, 1, axis=0)
+    nexxt = np.roll(line, -1, axis=0)
+    a = line - prev
+    b = nexxt - line
+    cross = a[:, 0] * b[:, 1] - a[:, 1] * b[:, 0]
+    denom = np.linalg.norm(a, axis=1) * np.linalg.norm(b, axis=1) * np.linalg.norm(nexxt - prev, axis=1)
+    curvature = np.zeros(len(line))
+    np.divide(2 * (cross if signed else np.abs(cross)), denom, out=curvature, where=denom > 0)
+    return curvature
+
+
+def line_score(line, curvature_weight=1.0):
+    '''Length plus weighted bending energy of a closed line; lower is better'''
+    ds = line_segment_lengths(line)
+    return ds.sum() + curvature_weight * np.sum(line_curvature(line) ** 2 * ds)
+
+
+TELEMETRY_FIELDS = ["pass", "max_displacement", "mean_displacement", "length", "max_curvature", "rejected", "seconds"]
+
+
+class SolveTelemetry:
+    '''Per-pass solver measurements kept in one preallocated array (doubled when it fills up)'''
+
+    def __init__(self, capacity=512):
+        self.data = np.zeros((max(1, capacity), len(TELEMETRY_FIELDS)))
+        self.count = 0
+        self.passes = 0
+
+    def record(self, old_line, new_line, rejected, seconds, passes=1):
+        '''Add one row for the passes that turned old_line into new_line'''
+        if self.count == len(self.data):
+            self.data = np.vstack([self.data, np.zeros_like(self.data)])
+        self.passes += passes
+        displacement = np.linalg.norm(np.asarray(new_line) - np.asarray(old_line), axis=1)
+        self.data[self.count] = (self.passes, displacement.max(), displacement.mean(),
+                                 line_segment_lengths(new_line).sum(), line_curvature(new_line).max(),
+                                 rejected, seconds)
+        self.count += 1
+
+    def columns(self):
+        return {name: self.data[:self.count, k] for k, name in enumerate(TELEMETRY_FIELDS)}
+
+    def to_csv(self):
+        rows = [",".join(TELEMETRY_FIELDS)]
+        rows += [",".join(f"{value:g}" for value in row) for row in self.data[:self.count]]
+        return "\n".join(rows) + "\n"
+
+    def to_json(self):
+        return json.dumps({name: values.tolist() for name, values in self.columns().items()})
+
+
+def anytime_improve_race_line(race_line, inner_border, outer_border, time_budget, xi_iterations=5, progress=None,
+                              preview=None, telemetry=None, best=None):
+    '''Run improve_points passes over the whole line until time_budget seconds are used and return the best line seen.
+
+    progress(passes_done, passes_per_second, best_score) and preview(current_line) are called after every pass,
+    and best(best_line) after every pass that improves on the best score.
+    Returns (best_line, passes_done, passes_per_second).
+    '''
+    ls_inner_border = Polygon(inner_border)
+    ls_outer_border = Polygon(outer_border)
+    line = np.array(race_line, dtype=np.float64)
+    best_line = line.copy()
+    best_score = line_score(line)
+    passes = 0
+    start = time.perf_counter()
+    deadline = start + time_budget
+    pass_time = 0.0
+    # Only start a pass that is expected to finish inside the budget
+    while time.perf_counter() + pass_time <= deadline:
+        pass_start = time.perf_counter()
+        old_line = line.copy() if telemetry is not None else None
+        rejected = improve_points(line, range(len(line)), ls_inner_border, ls_outer_border, xi_iterations)
+        passes += 1
+        score = line_score(line)
+        if score < best_score:
+            best_score = score
+            best_line = line.copy()
+            if best is not None:
+                best(best_line)
+        now = time.perf_counter()
+        pass_time = now - pass_start
+        if telemetry is not None:
+            telemetry.record(old_line, line, rejected, pass_time)
+        if progress is not None:
+            progress(passes, passes / (now - start), best_score)
+        if preview is not None:
+            preview(line)
+    elapsed = time.perf_counter() - start
+    return best_line, passes, (passes / elapsed if elapsed > 0 else 0.0)
@@ -0,0 +1,337 @@
+import base64
+import struct
+
+import numpy as np
+
+from race_line import line_curvature
+from speed_profile import batch_speed_profiles
+
+# Race line bundle: a fixed 32 byte little-endian header (magic, version, race line
+# point count, border point count, then the min speed, max speed and look-ahead the
+# speed array was computed with) followed by float32 arrays in BUNDLE_FIELDS order.
+# The race line is stored open, without repeating its first point at the end.
+# Version 1 left the speed settings as reserved zero bytes.
+BUNDLE_MAGIC = b"RLBUNDLE"
+BUNDLE_VERSION = 2
+BUNDLE_HEADER = struct.Struct("<8sIIIffI")
+BUNDLE_FIELDS = [("race_line", "line", 2), ("inner_border", "border", 2), ("outer_border", "border", 2),
+                 ("speed", "line", 1), ("curvature", "line", 1), ("heading", "line", 1)]
+BUNDLE_EXTENSION = "rlb"
+
+# Grid cells are matched to race line points this many at a time to bound memory
+GRID_CHUNK_CELLS = 4096
+
+# Smallest number of control points tried when fitting a spline to a race line
+MIN_SPLINE_CONTROL_POINTS = 4
+# Most control points tried per spline however long the race line; the position spline also
+# stops at half the race line points, past which there is little left to compress
+MAX_SPLINE_CONTROL_POINTS = 1000
+# Std, in race line points, of the Gaussian the speed profile is smoothed with before its spline
+# is fitted; the grip-limited profile can jump between neighbouring points where no cubic follows it
+SPEED_SMOOTHING_POINTS = 1.0
+# Samples per spline span the generated evaluator precomputes for its closest point search
+SPLINE_SEARCH_SAMPLES = 4
+# Side of the generated evaluator's search grid cells, in sample spacings
+SPLINE_SEARCH_CELL_SAMPLES = 2
+
+
+def race_line_headings(race_line):
+    '''Heading in degrees from every point of a closed race line to the next one'''
+    race_line = np.asarray(race_line, dtype=np.float64)
+    delta = np.roll(race_line, -1, axis=0) - race_line
+    return np.degrees(np.arctan2(delta[:, 1], delta[:, 0]))
+
+
+def closest_point_grid(race_line, bounds_points, cell_size, min_speed=1.5, max_speed=4.0, look_ahead_points=0):
+    '''Uniform grid over the track mapping every cell to the race line point closest to its centre.
+
+    race_line is the closed line without its closing point and bounds_points any points
+    (e.g. the borders) whose bounding box the grid must cover. Looking up a position
+    returns a point at most one cell diagonal further away than the true closest point.
+    '''
+    race_line = np.asarray(race_line, dtype=np.float64)[:, :2]
+    bounds_points = np.asarray(bounds_points, dtype=np.float64)[:, :2]
+    x0, y0 = bounds_points.min(axis=0) - cell_size
+    x1, y1 = bounds_points.max(axis=0) + cell_size
+    cols = int(np.ceil((x1 - x0) / cell_size))
+    rows = int(np.ceil((y1 - y0) / cell_size))
+
+    centres_x = x0 + (np.arange(cols) + 0.5) * cell_size
+    centres_y = y0 + (np.arange(rows) + 0.5) * cell_size
+    centres = np.stack(np.meshgrid(centres_x, centres_y), axis=-1).reshape(-1, 2)
+    index_dtype = np.uint16 if len(race_line) <= np.iinfo(np.uint16).max else np.uint32
+    grid = np.empty(len(centres), dtype=index_dtype)
+    for start in range(0, len(centres), GRID_CHUNK_CELLS):
+        chunk = centres[start:start + GRID_CHUNK_CELLS]
+        dist = ((chunk[:, None, :] - race_line[None, :, :]) ** 2).sum(axis=2)
+        grid[start:start + len(chunk)] = dist.argmin(axis=1)
+
+    velocity = batch_speed_profiles([race_line], min_speed, max_speed, look_ahead_points)[0][0]
+    lookup = {
+        "origin": (float(x0), float(y0)),
+        "cell_size": float(cell_size),
+        "shape": (rows, cols),
+        "grid": grid.reshape(rows, cols),
+        "heading": race_line_headings(race_line).astype(np.float32),
+        "speed": velocity.astype(np.float32),
+    }
+    lookup["nbytes"] = lookup["grid"].nbytes + lookup["heading"].nbytes + lookup["speed"].nbytes
+    lookup["max_error"] = float(cell_size * np.sqrt(2))
+    return lookup
+
+
+def lookup_grid_source(lookup):
+    '''Standalone Python source for a reward function to do O(1) closest race line point lookups'''
+    rows, cols = lookup["shape"]
+    typecode = 'H' if lookup["grid"].dtype == np.uint16 else 'I'
+    grid_bytes = lookup["grid"].astype(lookup["grid"].dtype.newbyteorder('<')).tobytes()
+    headings = ", ".join(f"{h:.2f}" for h in lookup["heading"])
+    speeds = ", ".join(f"{v:.3f}" for v in lookup["speed"])
+    return f'''import array
+import base64
+import sys
+
+# Generated race line lookup grid: {rows} x {cols} cells of {lookup["cell_size"]:g},
+# worst-case error {lookup["max_error"]:.4f} beyond the true closest point.
+GRID_X0, GRID_Y0 = {lookup["origin"][0]!r}, {lookup["origin"][1]!r}
+CELL_SIZE = {lookup["cell_size"]!r}
+GRID_ROWS, GRID_COLS = {rows}, {cols}
+_GRID = array.array('{typecode}', base64.b64decode("{base64.b64encode(grid_bytes).decode('ascii')}"))
+if sys.byteorder != 'little':
+    _GRID.byteswap()
+HEADINGS = [{headings}]
+SPEEDS = [{speeds}]
+
+
+def closest_race_line_index(x, y):
+    col = min(max(int((x - GRID_X0) / CELL_SIZE), 0), GRID_COLS - 1)
+    row = min(max(int((y - GRID_Y0) / CELL_SIZE), 0), GRID_ROWS - 1)
+    return _GRID[row * GRID_COLS + col]
+'''
+
+
+def _spline_basis(u, control_points):
+    # Uniform closed cubic B-spline basis at lap fractions u, as (weights, control point indexes) rows
+    t = np.mod(u, 1.0) * control_points
+    span = np.minimum(np.floor(t).astype(int), control_points - 1)
+    f = (t - span)[:, None]
+    weights = np.hstack([(1 - f) ** 3, 3 * f ** 3 - 6 * f ** 2 + 4, -3 * f ** 3 + 3 * f ** 2 + 3 * f + 1, f ** 3]) / 6
+    indexes = (span[:, None] + np.arange(-1, 3)) % control_points
+    return weights, indexes
+
+
+def _evaluate_spline(control, u):
+    weights, indexes = _spline_basis(np.asarray(u, dtype=np.float64), len(control))
+    return np.einsum('nk,nkc->nc', weights, control[indexes])
+
+
+def spline_points(spline, u):
+    '''Race line x, y and speed of a fitted spline at lap fractions u, as a (len(u), 3) array'''
+    return np.hstack([_evaluate_spline(spline["control"], u), _evaluate_spline(spline["speed_control"][:, None], u)])
+
+
+def _least_squares_spline(u, values, control_points):
+    weights, indexes = _spline_basis(u, control_points)
+    # Normal equations of the least squares fit; the small ridge keeps spans without samples solvable
+    normal = np.zeros((control_points, control_points))
+    np.add.at(normal, (indexes[:, :, None], indexes[:, None, :]), weights[:, :, None] * weights[:, None, :])
+    rhs = np.zeros((control_points, values.shape[1]))
+    np.add.at(rhs, indexes, weights[:, :, None] * values[:, None, :])
+    normal[np.diag_indices(control_points)] += 1e-9 * np.trace(normal) / control_points
+    return np.linalg.solve(normal, rhs)
+
+
+def _fewest_control_points(u, values, max_error, limit):
+    # Double the control points until the worst error is small enough, then bisect down to the fewest that are
+    def fit(control_points):
+        control = _least_squares_spline(u, values, control_points)
+        return control, float(np.linalg.norm(_evaluate_spline(control, u) - values, axis=1).max())
+
+    limit = max(MIN_SPLINE_CONTROL_POINTS, min(limit, MAX_SPLINE_CONTROL_POINTS))
+    low, high = MIN_SPLINE_CONTROL_POINTS - 1, MIN_SPLINE_CONTROL_POINTS
+    best = fit(high)
+    while best[1] > max_error and high < limit:
+        low, high = high, min(2 * high, limit)
+        best = fit(high)
+    while best[1] <= max_error and high - low > 1:
+        middle = (low + high) // 2
+        candidate = fit(middle)
+        if candidate[1] <= max_error:
+            high, best = middle, candidate
+        else:
+            low = middle
+    return best
+
+
+def smooth_closed_profile(values, std_points):
+    '''Values around a closed lap smoothed with a Gaussian of std_points points, wrapping at the ends'''
+    values = np.asarray(values, dtype=np.float64)
+    if std_points <= 0:
+        return values.copy()
+    frequency = np.fft.rfftfreq(len(values))
+    kernel = np.exp(-0.5 * (2 * np.pi * frequency * std_points) ** 2)
+    return np.fft.irfft(np.fft.rfft(values) * kernel, len(values))
+
+
+def fit_race_line_spline(race_line, speed, max_error, max_speed_error=0.1, speed_smoothing=SPEED_SMOOTHING_POINTS):
+    '''Closed cubic B-splines with the fewest control points that follow a race line and its speed profile.
+
+    race_line is the closed line without its closing point. Position and speed are separate
+    splines over the fraction of a lap (chord length), since the speed profile usually needs
+    far more control points than the line. The speed spline follows the profile smoothed over
+    speed_smoothing points, and its reported error is against that smoothed profile. If half as
+    many position control points as race line points (as many for speed) are not enough, the
+    largest spline tried is kept and its reported error is above the one asked for.
+    '''
+    race_line = np.asarray(race_line, dtype=np.float64)[:, :2]
+    speed = smooth_closed_profile(speed, speed_smoothing)
+    steps = np.linalg.norm(np.diff(np.vstack([race_line, race_line[:1]]), axis=0), axis=1)
+    u = np.concatenate([[0.0], np.cumsum(steps)[:-1]]) / steps.sum()
+    control, error = _fewest_control_points(u, race_line, max_error, len(race_line) // 2)
+    speed_control, speed_error = _fewest_control_points(u, speed[:, None], max_speed_error, len(speed))
+    return {
+        "control": control,
+        "speed_control": speed_control[:, 0],
+        "points": len(race_line),
+        "max_error": error,
+        "max_speed_error": speed_error,
+        "speed_smoothing": speed_smoothing,
+        "compression_ratio": (race_line.size + speed.size) / (control.size + len(speed_control)),
+    }
+
+
+def race_line_spline_source(spline):
+    '''Standalone Python source for a reward function to evaluate a fitted race line spline'''
+    def literal(values):
+        return "[" + ", ".join(f"{v:.4f}" for v in values) + "]"
+    samples = SPLINE_SEARCH_SAMPLES * len(spline["control"])
+    sample_points = _evaluate_spline(spline["control"], np.arange(samples) / samples)
+    spacing = np.linalg.norm(sample_points - np.roll(sample_points, 1, axis=0), axis=1).max()
+    return f'''# Generated race line spline: {len(spline["control"])} position and {len(spline["speed_control"])} speed
+# control points for {spline["points"]} race line points, worst-case deviation
+# {spline["max_error"]:.4f} in position and {spline["max_speed_error"]:.4f} in speed (speed profile
+# smoothed over {spline["speed_smoothing"]:g} points).
+CONTROL_X = {literal(spline["control"][:, 0])}
+CONTROL_Y = {literal(spline["control"][:, 1])}
+CONTROL_SPEED = {literal(spline["speed_control"])}
+
+
+def _spline(control, u):
+    # Uniform closed cubic B-spline through control at fraction u of a lap
+    spans = len(control)
+    t = (u % 1.0) * spans
+    i = min(int(t), spans - 1)
+    f = t - i
+    weights = ((1 - f) ** 3 / 6, (3 * f ** 3 - 6 * f ** 2 + 4) / 6, (-3 * f ** 3 + 3 * f ** 2 + 3 * f + 1) / 6, f ** 3 / 6)
+    return sum(w * control[(i + k - 1) % spans] for k, w in enumerate(weights))
+
+
+def race_line_at(u):
+    # (x, y) on the race line at fraction u of a lap
+    return _spline(CONTROL_X, u), _spline(CONTROL_Y, u)
+
+
+def speed_at(u):
+    return _spline(CONTROL_SPEED, u)
+
+
+_SAMPLES = [race_line_at(k / {samples}) for k in range({samples})]
+# Samples bucketed by grid cell, so finding the nearest one only looks at cells around the car
+_CELL = {SPLINE_SEARCH_CELL_SAMPLES * max(spacing, 1e-3):.4f}
+_CELLS = {{}}
+for _k, (_x, _y) in enumerate(_SAMPLES):
+    _CELLS.setdefault((int(_x // _CELL), int(_y // _CELL)), []).append(_k)
+
+
+def _nearest_sample(x, y):
+    # Search square rings of cells outwards; every cell past ring r is at least r cells away
+    cx, cy = int(x // _CELL), int(y // _CELL)
+    best, best_distance = 0, float("inf")
+    ring = 0
+    while True:
+        for i in range(cx - ring, cx + ring + 1):
+            edge = abs(i - cx) == ring
+            for j in range(cy - ring, cy + ring + 1, 1 if edge else 2 * ring):
+                for k in _CELLS.get((i, j), ()):
+                    distance = (_SAMPLES[k][0] - x) ** 2 + (_SAMPLES[k][1] - y) ** 2
+                    if distance < best_distance:
+                        best, best_distance = k, distance
+        if best_distance <= (ring * _CELL) ** 2:
+            return best
+        ring += 1
+
+
+def closest_race_line_fraction(x, y):
+    # Lap fraction of the race line point closest to (x, y): nearest sample, then a ternary search around it
+    def distance(u):
+        px, py = race_line_at(u)
+        return (px - x) ** 2 + (py - y) ** 2
+    nearest = _nearest_sample(x, y)
+    low, high = (nearest - 1) / len(_SAMPLES), (nearest + 1) / len(_SAMPLES)
+    for _ in range(20):
+        a, b = low + (high - low) / 3, high - (high - low) / 3
+        if distance(a) < distance(b):
+            high = b
+        else:
+            low = a
+    return ((low + high) / 2) % 1.0
+'''
+
+
+def race_line_bundle_bytes(race_line, inner_border, outer_border, min_speed=1.5, max_speed=4.0, look_ahead_points=0,
+                           curvature=None, heading=None):
+    '''Pack a race line, its borders and per-point speed, curvature and heading into one bundle.
+
+    The speed is computed with the given settings, which are stored in the header alongside it.
+    '''
+    race_line = np.asarray(race_line, dtype=np.float64)[:, :2]
+    arrays = {
+        "race_line": race_line,
+        "inner_border": np.asarray(inner_border)[:, :2],
+        "outer_border": np.asarray(outer_border)[:, :2],
+        "speed": batch_speed_profiles([race_line], min_speed, max_speed, look_ahead_points)[0][0],
+        "curvature": line_curvature(race_line) if curvature is None else curvature,
+        "heading": race_line_headings(race_line) if heading is None else heading,
+    }
+    if len(arrays["inner_border"]) != len(arrays["outer_border"]):
+        raise ValueError("Inner and outer borders must have the same number of points")
+    header = BUNDLE_HEADER.pack(BUNDLE_MAGIC, BUNDLE_VERSION, len(race_line), len(arrays["inner_border"]),
+                                min_speed, max_speed, look_ahead_points)
+    body = [np.ascontiguousarray(arrays[name], dtype='<f4').tobytes() for name, _, _ in BUNDLE_FIELDS]
+    return header + b"".join(body)
+
+
+def is_race_line_bundle(data):
+    return bytes(data[:len(BUNDLE_MAGIC)]) == BUNDLE_MAGIC
+
+
+def load_race_line_bundle(source):
+    '''Read a bundle from a path (memory mapped) or bytes without copying.
+
+    Returns a dict of float32 arrays, plus "speed_settings": (min_speed, max_speed, look_ahead_points)
+    the speed was computed with, or None for version 1 bundles that did not record them.
+    '''
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        data = np.frombuffer(source, dtype=np.uint8)
+    else:
+        data = np.memmap(source, dtype=np.uint8, mode='r')
+    if len(data) < BUNDLE_HEADER.size:
+        raise ValueError("Not a race line bundle")
+    magic, version, line_points, border_points, min_speed, max_speed, look_ahead_points = BUNDLE_HEADER.unpack(
+        data[:BUNDLE_HEADER.size].tobytes())
+    if magic != BUNDLE_MAGIC:
+        raise ValueError("Not a race line bundle")
+    if version not in (1, BUNDLE_VERSION):
+        raise ValueError(f"Unsupported race line bundle version {version}")
+
+    arrays = {"speed_settings": (round(min_speed, 4), round(max_speed, 4), look_ahead_points) if version >= 2 else None}
+    offset = BUNDLE_HEADER.size
+    for name, count, width in BUNDLE_FIELDS:
+        points = line_points if count == "line" else border_points
+        nbytes = points * width * 4
+        if offset + nbytes > len(data):
+            raise ValueError("Truncated race line bundle")
+        values = data[offset:offset + nbytes].view('<f4')
+        arrays[name] = values.reshape(points, width) if width > 1 else values
+        offset += nbytes
+    return arrays
@@ -0,0 +1,344 @@
+import hashlib
+import itertools
+import multiprocessing
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from concurrent.futures import Future, ProcessPoolExecutor
+
+import numpy as np
+from shapely.geometry import Polygon
+
+from race_line import improve_points, SolveTelemetry
+from track_variants import match_track_variant, derive_race_line
+
+# How often (in passes) a running solve publishes its progress
+PROGRESS_EVERY = 10
+# Seconds between snapshots of the current line published by a running solve
+SNAPSHOT_INTERVAL = 0.5
+# Seconds between checks for free solver slots while a reservation waits
+RESERVE_POLL_INTERVAL = 0.5
+
+
+def solve_key(waypoints, line_iterations, xi_iterations):
+    '''Identity of a solve request: hash of the track arrays plus the solver parameters'''
+    waypoints = np.ascontiguousarray(waypoints, dtype=np.float64)
+    digest = hashlib.blake2b(waypoints.tobytes(), digest_size=16)
+    digest.update(repr(waypoints.shape).encode())
+    return f"{digest.hexdigest()}-{line_iterations}-{xi_iterations}"
+
+
+def solve_race_line(waypoints, line_iterations, xi_iterations, progress=None, telemetry=None):
+    '''Run line_iterations passes from the center line; progress(passes_done, line) every PROGRESS_EVERY passes'''
+    waypoints = np.asarray(waypoints, dtype=np.float64)
+    race_line = np.array(waypoints[:-1, 0:2])
+    ls_inner_border = Polygon(waypoints[:, 2:4])
+    ls_outer_border = Polygon(waypoints[:, 4:6])
+    for i in range(1, line_iterations + 1):
+        pass_start = time.perf_counter()
+        old_line = race_line.copy() if telemetry is not None else None
+        rejected = improve_points(race_line, range(len(race_line)), ls_inner_border, ls_outer_border, xi_iterations)
+        if telemetry is not None:
+            telemetry.record(old_line, race_line, rejected, time.perf_counter() - pass_start)
+        if progress is not None and i % PROGRESS_EVERY == 0:
+            progress(i, race_line)
+    return race_line
+
+
+class SolveCancelled(Exception):
+    '''Raised inside a worker when the job it is running was cancelled'''
+
+
+def _run_job(key, waypoints, line_iterations, xi_iterations, progress, snapshots, cancelled):
+    last_snapshot = [0.0]
+
+    def report(passes, line):
+        if key in cancelled:
+            raise SolveCancelled(key)
+        progress[key] = passes
+        # Copying the line to the manager process is throttled by time, not passes
+        if time.time() - last_snapshot[0] >= SNAPSHOT_INTERVAL:
+            snapshots[key] = line.copy()
+            last_snapshot[0] = time.time()
+    telemetry = SolveTelemetry(line_iterations)
+    return solve_race_line(waypoints, line_iterations, xi_iterations, report, telemetry), telemetry
+
+
+class SolveJob:
+    '''One distinct solve, shared by every user that asked for it'''
+
+    def __init__(self, key, owner, waypoints, line_iterations, xi_iterations):
+        self.key = key
+        self.owner = owner
+        self.users = {owner}
+        self.args = (waypoints, line_iterations, xi_iterations)
+        self.waypoints = waypoints
+        self.line_iterations = line_iterations
+        self.xi_iterations = xi_iterations
+        # Set when this job reuses the solve of a reversed or mirrored copy of its track
+        self.source = None
+        self.variant = None
+        self.future = Future()
+        # Names this run in the shared progress, snapshot and cancel dicts while it is in a worker
+        self.run_key = None
+        self._started = None
+        self.telemetry = None
+
+    @property
+    def started(self):
+        '''When the solve producing this job's line started, None while it is queued'''
+        return self.source.started if self.source is not None else self._started
+
+    @started.setter
+    def started(self, value):
+        self._started = value
+
+    def done(self):
+        return self.future.done()
+
+    def result(self, timeout=None):
+        return self.future.result(timeout)
+
+
+class SolveJobManager:
+    '''Process-wide solve queue: identical requests share one job, at most max_workers jobs run
+    at once, and queued jobs are started round-robin across users so nobody can starve the rest.
+    Finished results are kept for the max_results most recent jobs. A track that is a reversed
+    or mirrored copy of one already queued, running or solved with the same settings reuses
+    that solve instead of starting its own. A job every user has cancelled is dropped from the
+    queue or stopped at its next progress report. Solves run outside the queue reserve their share
+    of the max_workers slots, so every kind of solve on the server counts against one limit.
+    '''
+
+    def __init__(self, max_workers, max_results=32):
+        self.max_workers = max_workers
+        self.max_results = max_results
+        self._lock = threading.RLock()
+        self._jobs = OrderedDict()
+        self._queues = OrderedDict()
+        self._running = 0
+        self._reserved = 0
+        # Worker counts of reservations still waiting for their slots, first come first served
+        self._waiting = deque()
+        self._executor = None
+        self._progress = None
+        self._snapshots = None
+        self._cancelled = None
+        self._shared = None
+        self._run_ids = itertools.count()
+
+    def submit(self, user_id, waypoints, line_iterations, xi_iterations):
+        '''Job for this request, joining an identical queued, running or finished one if there is one'''
+        key = solve_key(waypoints, line_iterations, xi_iterations)
+        with self._lock:
+            job = self._jobs.get(key)
+            if job is not None:
+                job.users.add(user_id)
+                self._jobs.move_to_end(key)
+                return job
+            job = SolveJob(key, user_id, np.asarray(waypoints, dtype=np.float64), line_iterations, xi_iterations)
+            self._jobs[key] = job
+            if self._reuse_variant(job):
+                return job
+            self._queues.setdefault(user_id, deque()).append(job)
+            self._dispatch()
+            return job
+
+    def queue_position(self, job):
+        '''1-based place of a queued job in start order, 0 once it is running or done'''
+        if job.source is not None:
+            return self.queue_position(job.source)
+        with self._lock:
+            queues = [list(q) for q in self._queues.values()]
+        position = 0
+        # Replay the round-robin order the dispatcher will follow
+        for queued in _round_robin(queues):
+            position += 1
+            if queued is job:
+                return position
+        return 0
+
+    def progress(self, job):
+        '''Passes completed by a running job'''
+        if job.done():
+            return job.line_iterations
+        if job.source is not None:
+            return self.progress(job.source)
+        if self._progress is None or job.started is None:
+            return 0
+        return self._progress.get(job.run_key, 0)
+
+    def snapshot(self, job):
+        '''Most recent intermediate line of a running job (None before the first one), or its result'''
+        if job.done():
+            return job.result()
+        if job.source is not None:
+            snapshot = self.snapshot(job.source)
+            return None if snapshot is None else derive_race_line(snapshot, job.variant)
+        if self._snapshots is None or job.started is None:
+            return None
+        return self._snapshots.get(job.run_key)
+
+    def cancel(self, job, user_id):
+        '''Stop waiting on job for user_id; True if that left nobody waiting and the job was cancelled'''
+        with self._lock:
+            job.users.discard(user_id)
+            if job.done() or self._waited_on(job):
+                return False
+            self._drop(job)
+            return True
+
+    @contextmanager
+    def reserve(self, workers, waiting=None):
+        '''Hold workers solver slots (at most max_workers) for a solve that runs its own processes.
+
+        Blocks until that many slots are free of jobs and earlier reservations, calling waiting()
+        between checks. While it waits, queued jobs are not started in the slots it needs, and
+        they do not start in the held slots until the block exits.
+        '''
+        # A list per reservation, so waiters asking for the same count stay distinct in the queue
+        ticket = [max(1, min(workers, self.max_workers))]
+        with self._lock:
+            self._waiting.append(ticket)
+        held = False
+        try:
+            while not held:
+                with self._lock:
+                    if self._waiting[0] is ticket and self._running + self._reserved + ticket[0] <= self.max_workers:
+                        self._waiting.popleft()
+                        self._reserved += ticket[0]
+                        held = True
+                        break
+                if waiting is not None:
+                    waiting()
+                time.sleep(RESERVE_POLL_INTERVAL)
+            yield ticket[0]
+        finally:
+            with self._lock:
+                if held:
+                    self._reserved -= ticket[0]
+                else:
+                    self._waiting.remove(ticket)
+                self._dispatch()
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+
+    def _reuse_variant(self, job):
+        # Called with the lock held; newest jobs first, skipping ones that already failed
+        for source in reversed(self._jobs.values()):
+            if (source is job or source.xi_iterations != job.xi_iterations
+                    or source.line_iterations != job.line_iterations
+                    or (source.done() and source.future.exception() is not None)):
+                continue
+            variant = match_track_variant(source.waypoints, job.waypoints)
+            if variant is None:
+                continue
+            job.source, job.variant, job.args = source, variant, None
+            source.future.add_done_callback(lambda f, job=job: self._finish_variant(job, f))
+            return True
+        return False
+
+    def _waited_on(self, job):
+        # Called with the lock held; pending variant jobs wait on their source too
+        return bool(job.users) or any(other.source is job and not other.done() for other in self._jobs.values())
+
+    def _drop(self, job):
+        # Called with the lock held, for a pending job nobody waits on any more
+        if self._jobs.get(job.key) is job:
+            del self._jobs[job.key]
+        job.future.cancel()
+        if job.source is not None:
+            if not job.source.done() and not self._waited_on(job.source):
+                self._drop(job.source)
+        elif job.started is None:
+            queue = self._queues[job.owner]
+            queue.remove(job)
+            if not queue:
+                del self._queues[job.owner]
+        else:
+            # A running solve cannot be interrupted from here; the worker gives up at its next report
+            self._cancelled[job.run_key] = True
+
+    def _finish_variant(self, job, source_future):
+        with self._lock:
+            if job.future.cancelled():
+                return
+            if source_future.exception() is not None:
+                self._jobs.pop(job.key, None)
+                job.future.set_exception(source_future.exception())
+                return
+            race_line = derive_race_line(source_future.result(), job.variant)
+            race_line.flags.writeable = False
+            job.telemetry = job.source.telemetry
+            job.future.set_result(race_line)
+            self._evict()
+
+    def _dispatch(self):
+        # Called with the lock held
+        # Slots that waiting reservations need are kept free as running jobs finish
+        waiting = sum(ticket[0] for ticket in self._waiting)
+        while self._running + self._reserved + waiting < self.max_workers and self._queues:
+            user_id, queue = next(iter(self._queues.items()))
+            job = queue.popleft()
+            if queue:
+                self._queues.move_to_end(user_id)
+            else:
+                del self._queues[user_id]
+            self._start(job)
+
+    def _start(self, job):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+            self._shared = multiprocessing.Manager()
+            self._progress = self._shared.dict()
+            self._snapshots = self._shared.dict()
+            self._cancelled = self._shared.dict()
+        self._running += 1
+        job.started = time.time()
+        job.run_key = f"{job.key}:{next(self._run_ids)}"
+        try:
+            future = self._executor.submit(_run_job, job.run_key, *job.args, self._progress, self._snapshots,
+                                           self._cancelled)
+        except Exception as e:
+            self._running -= 1
+            self._jobs.pop(job.key, None)
+            job.future.set_exception(e)
+            return
+        future.add_done_callback(lambda f, job=job: self._finish(job, f))
+
+    def _finish(self, job, future):
+        with self._lock:
+            self._running -= 1
+            for shared in (self._progress, self._snapshots, self._cancelled):
+                shared.pop(job.run_key, None)
+            job.args = None
+            if job.future.cancelled():
+                # Dropped by cancel; whatever the worker returned is not wanted
+                pass
+            elif future.exception() is not None:
+                # Forget failed jobs so the next request retries
+                self._jobs.pop(job.key, None)
+                job.future.set_exception(future.exception())
+            else:
+                race_line, job.telemetry = future.result()
+                race_line.flags.writeable = False
+                job.future.set_result(race_line)
+                self._evict()
+            self._dispatch()
+
+    def _evict(self):
+        finished = [key for key, job in self._jobs.items() if job.done()]
+        for key in finished[:max(0, len(finished) - self.max_results)]:
+            del self._jobs[key]
+
+
+def _round_robin(queues):
+    queues = [deque(q) for q in queues if q]
+    while queues:
+        queue = queues.pop(0)
+        yield queue.popleft()
+        if queue:
+            queues.append(queue)
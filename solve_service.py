@@ -0,0 +1,161 @@
+"""Local HTTP/JSON race line service.
+
+    python solve_service.py --port 8502
+
+GET  /tracks  catalog track names
+POST /solve   {"track": "Oval_track.npy"} or {"waypoints": [[cx, cy, ix, iy, ox, oy], ...]},
+              optional line_iterations, xi_iterations, min_speed, max_speed, look_ahead_points.
+              Returns race_line, speed, lap_time and race_line_length. With "stream": true the
+              response is newline-delimited JSON progress updates ending with the result.
+"""
+import argparse
+import functools
+import json
+import os
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+from shapely.geometry import LineString
+
+from solve_jobs import SolveJobManager
+from speed_profile import batch_speed_profiles
+from track_catalog import fetch_track, tracks
+
+DEFAULTS = {"line_iterations": 500, "xi_iterations": 5, "min_speed": 1.5, "max_speed": 4.0, "look_ahead_points": 0}
+# Seconds between progress lines on a streamed solve
+STREAM_INTERVAL = 0.5
+
+
+class SolveRequestError(ValueError):
+    pass
+
+
+@functools.lru_cache(maxsize=32)
+def catalog_track(name):
+    if name not in tracks:
+        raise SolveRequestError(f"Unknown track {name!r}")
+    waypoints = np.asarray(fetch_track(name), dtype=np.float64)
+    waypoints.flags.writeable = False
+    return waypoints
+
+
+def parse_solve_request(body):
+    '''Waypoints and solver settings from a /solve request body'''
+    if "track" in body:
+        waypoints = catalog_track(body["track"])
+    elif "waypoints" in body:
+        waypoints = np.asarray(body["waypoints"], dtype=np.float64)
+    else:
+        raise SolveRequestError("Give either 'track' or 'waypoints'")
+    if waypoints.ndim != 2 or waypoints.shape[1] < 6 or len(waypoints) < 5:
+        raise SolveRequestError("Waypoints must be rows of center, inner and outer x/y")
+    settings = {key: type(default)(body.get(key, default)) for key, default in DEFAULTS.items()}
+    if settings["line_iterations"] < 1 or settings["xi_iterations"] < 1 or settings["look_ahead_points"] < 0:
+        raise SolveRequestError("Iteration counts must be positive")
+    if not 0 < settings["min_speed"] <= settings["max_speed"]:
+        raise SolveRequestError("Need 0 < min_speed <= max_speed")
+    return waypoints, settings
+
+
+def solve_result(race_line, settings):
+    velocities, distances, lap_times = batch_speed_profiles([race_line], settings["min_speed"], settings["max_speed"],
+                                                            settings["look_ahead_points"])
+    loop_race_line = np.append(race_line, [race_line[0]], axis=0)
+    return {
+        "race_line": loop_race_line.tolist(),
+        "speed": velocities[0].tolist(),
+        "lap_time": float(lap_times[0]),
+        "race_line_length": LineString(loop_race_line).length,
+    }
+
+
+class SolveRequestHandler(BaseHTTPRequestHandler):
+    manager = None
+
+    def do_GET(self):
+        if self.path == "/tracks":
+            self._send_json(200, {"tracks": tracks})
+        elif self.path == "/health":
+            self._send_json(200, {"status": "ok"})
+        else:
+            self._send_json(404, {"error": "Not found"})
+
+    def do_POST(self):
+        if self.path != "/solve":
+            self._send_json(404, {"error": "Not found"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            body = json.loads(self.rfile.read(length) or b"{}")
+            waypoints, settings = parse_solve_request(body)
+        except (ValueError, TypeError) as e:
+            self._send_json(400, {"error": str(e)})
+            return
+        except Exception as e:
+            self._send_json(502, {"error": f"Could not load track: {e}"})
+            return
+
+        client = body.get("client", self.client_address[0])
+        job = self.manager.submit(client, waypoints, settings["line_iterations"], settings["xi_iterations"])
+        if not body.get("stream"):
+            try:
+                self._send_json(200, solve_result(job.result(), settings))
+            except Exception as e:
+                self._send_json(500, {"error": str(e)})
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.end_headers()
+        while not job.done():
+            position = self.manager.queue_position(job)
+            if position:
+                self._write_line({"status": "queued", "position": position})
+            else:
+                self._write_line({"status": "running", "iteration": self.manager.progress(job),
+                                  "line_iterations": settings["line_iterations"]})
+            time.sleep(STREAM_INTERVAL)
+        try:
+            self._write_line(dict(status="done", **solve_result(job.result(), settings)))
+        except Exception as e:
+            self._write_line({"status": "error", "error": str(e)})
+
+    def _send_json(self, status, payload):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _write_line(self, payload):
+        self.wfile.write(json.dumps(payload).encode() + b"\n")
+        self.wfile.flush()
+
+
+def make_server(host="127.0.0.1", port=8502, workers=None):
+    '''HTTP server whose solves run on a shared SolveJobManager; serve with .serve_forever()'''
+    handler = type("Handler", (SolveRequestHandler,), {"manager": SolveJobManager(max_workers=workers or os.cpu_count() or 1)})
+    return ThreadingHTTPServer((host, port), handler)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local race line solve service")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8502)
+    parser.add_argument("--workers", type=int, default=None, help="solver processes (default: all cores)")
+    args = parser.parse_args()
+    server = make_server(args.host, args.port, args.workers)
+    print(f"Serving race line solves on http://{args.host}:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.RequestHandlerClass.manager.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+import numpy as np
+
+
+def optimal_velocity(track, min_speed, max_speed, look_ahead_points):
+    '''Speed at every point of a closed track, as an array (see batch_speed_profiles)'''
+    return batch_speed_profiles([track], min_speed, max_speed, look_ahead_points)[0][0]
+
+def lap_time(track, velocity):
+    '''Time to drive a closed track when each point is reached at its velocity'''
+    track = np.asarray(track, dtype=np.float64)
+    distance_to_prev = np.linalg.norm(track - np.roll(track, 1, axis=0), axis=1)
+    return float(np.sum(distance_to_prev / np.asarray(velocity, dtype=np.float64)))
+
+#####################################################################
+# Batch evaluation: many closed race lines of different lengths are laid
+# end to end in one flat array, and every neighbour lookup is an index
+# array that wraps inside its own line, so all lines are scored at once.
+
+def _flat_neighbours(lengths):
+    '''Start offset per line, and for every point its line number and index within that line'''
+    lengths = np.asarray(lengths, dtype=np.int64)
+    starts = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+    line_of_point = np.repeat(np.arange(len(lengths)), lengths)
+    local = np.arange(lengths.sum()) - starts[line_of_point]
+    return starts, line_of_point, local
+
+
+def _shifted(starts, lengths, line_of_point, local, shift):
+    '''Flat index of the point shift places further along the same closed line'''
+    n = lengths[line_of_point]
+    return starts[line_of_point] + (local + shift) % n
+
+
+def circle_radii(points, prev_index, next_index):
+    '''Radius of the circle through every point and its neighbours (999 where they are collinear)'''
+    x1, y1 = points[:, 0], points[:, 1]
+    x2, y2 = points[prev_index, 0], points[prev_index, 1]
+    x3, y3 = points[next_index, 0], points[next_index, 1]
+    a = x1*(y2-y3) - y1*(x2-x3) + x2*y3 - x3*y2
+    b = (x1**2+y1**2)*(y3-y2) + (x2**2+y2**2)*(y1-y3) + (x3**2+y3**2)*(y2-y1)
+    c = (x1**2+y1**2)*(x2-x3) + (x2**2+y2**2)*(x3-x1) + (x3**2+y3**2)*(x1-x2)
+    d = (x1**2+y1**2)*(x3*y2-x2*y3) + (x2**2+y2**2) * (x1*y3-x3*y1) + (x3**2+y3**2)*(x2*y1-x1*y2)
+    radius = np.full(len(points), 999.0)
+    denom = np.abs(4*a**2)
+    np.divide(b**2+c**2-4*a*d, denom, out=radius, where=denom != 0)
+    return np.where(denom != 0, np.abs(radius) ** 0.5, 999.0)
+
+
+def batch_speed_profiles(tracks, min_speed, max_speed, look_ahead_points):
+    '''optimal_velocity, distance to previous point and lap time for many closed race lines at once.
+
+    Returns (velocities, distances, lap_times): one array per track for the first two,
+    one float per track for the last.
+    '''
+    tracks = [np.asarray(track, dtype=np.float64)[:, :2] for track in tracks]
+    if not tracks:
+        return [], [], np.zeros(0)
+    lengths = np.array([len(track) for track in tracks], dtype=np.int64)
+    points = np.concatenate(tracks)
+    starts, line_of_point, local = _flat_neighbours(lengths)
+    prev_index = _shifted(starts, lengths, line_of_point, local, -1)
+
+    radius = circle_radii(points, prev_index, _shifted(starts, lengths, line_of_point, local, 1))
+    # Same scaling as optimal_velocity: the tightest corner of each line runs at min_speed
+    constant_multiple = min_speed / np.minimum.reduceat(radius, starts) ** 0.5
+    radius_lookahead = radius
+    for j in range(1, look_ahead_points + 1):
+        radius_lookahead = np.minimum(radius_lookahead, radius[_shifted(starts, lengths, line_of_point, local, j)])
+    velocity = np.minimum(constant_multiple[line_of_point] * radius_lookahead ** 0.5, max_speed)
+
+    distance_to_prev = np.linalg.norm(points - points[prev_index], axis=1)
+    lap_times = np.add.reduceat(distance_to_prev / velocity, starts)
+    split = np.cumsum(lengths)[:-1]
+    return np.split(velocity, split), np.split(distance_to_prev, split), lap_times
+
+
+def race_line_leaderboard(race_lines, min_speed, max_speed, look_ahead_points):
+    '''Rank named race lines ({name: closed line without its closing point}) by lap time'''
+    names = list(race_lines)
+    velocities, distances, lap_times = batch_speed_profiles([race_lines[name] for name in names],
+                                                            min_speed, max_speed, look_ahead_points)
+    rows = [{
+        "name": name,
+        "points": len(distances[i]),
+        "race_line_length": float(distances[i].sum()),
+        "lap_time": float(lap_times[i]),
+        "mean_speed": float(velocities[i].mean()),
+    } for i, name in enumerate(names)]
+    rows.sort(key=lambda row: row["lap_time"])
+    return rows, dict(zip(names, velocities))
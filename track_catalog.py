@@ -0,0 +1,151 @@
+import argparse
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+import numpy as np
+import requests
+
+from race_line import line_curvature
+from track_variants import find_variants, variant_name
+
+# Prebuilt metadata for every catalog track, written by `python track_catalog.py`
+CATALOG_INDEX_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "track_catalog.json")
+# Points per line kept for the preview thumbnails
+THUMBNAIL_POINTS = 48
+
+# Define the URL structure for GitHub raw content
+base_url = "https://raw.githubusercontent.com/aws-deepracer-community/deepracer-race-data/main/raw_data/tracks/npy/"
+tracks = [
+    "2022_april_open.npy", "2022_april_open_ccw.npy", "2022_april_open_cw.npy",
+    "2022_april_pro.npy", "2022_april_pro_ccw.npy", "2022_april_pro_cw.npy",
+    "2022_august_open.npy", "2022_august_open_ccw.npy", "2022_august_open_cw.npy",
+    "2022_august_pro.npy", "2022_august_pro_ccw.npy", "2022_august_pro_cw.npy",
+    "2022_july_open.npy", "2022_july_pro.npy", "2022_july_pro_ccw.npy", "2022_july_pro_cw.npy",
+    "2022_june_open.npy", "2022_june_open_ccw.npy", "2022_june_open_cw.npy",
+    "2022_june_pro.npy", "2022_june_pro_ccw.npy", "2022_june_pro_cw.npy",
+    "2022_march_open.npy", "2022_march_open_ccw.npy", "2022_march_open_cw.npy",
+    "2022_march_pro.npy", "2022_march_pro_ccw.npy", "2022_march_pro_cw.npy",
+    "2022_may_open.npy", "2022_may_open_ccw.npy", "2022_may_open_cw.npy",
+    "2022_may_pro.npy", "2022_may_pro_ccw.npy", "2022_may_pro_cw.npy",
+    "2022_october_open.npy", "2022_october_open_ccw.npy", "2022_october_open_cw.npy",
+    "2022_october_pro.npy", "2022_october_pro_ccw.npy", "2022_october_pro_cw.npy",
+    "2022_reinvent_champ.npy", "2022_reinvent_champ_ccw.npy", "2022_reinvent_champ_cw.npy",
+    "2022_september_open.npy", "2022_september_open_ccw.npy", "2022_september_open_cw.npy",
+    "2022_september_pro.npy", "2022_september_pro_ccw.npy", "2022_september_pro_cw.npy",
+    "2022_summit_speedway.npy", "2022_summit_speedway_ccw.npy", "2022_summit_speedway_cw.npy", "2022_summit_speedway_mini.npy",
+    "AWS_track.npy", "Albert.npy", "AmericasGeneratedInclStart.npy",
+    "Aragon.npy", "Austin.npy", "Belille.npy",
+    "Bowtie_track.npy", "Canada_Training.npy", "China_track.npy",
+    "FS_June2020.npy", "H_track.npy", "July_2020.npy",
+    "LGSWide.npy", "Mexico_track.npy", "Monaco.npy",
+    "Monaco_building.npy", "New_York_Track.npy", "Oval_track.npy",
+    "Singapore.npy", "Singapore_building.npy", "Singapore_f1.npy",
+    "Spain_track.npy", "Spain_track_f1.npy", "Straight_track.npy",
+    "Tokyo_Training_track.npy", "Vegas_track.npy", "Virtual_May19_Train_track.npy",
+    "arctic_open.npy", "arctic_open_ccw.npy", "arctic_open_cw.npy",
+    "arctic_pro.npy", "arctic_pro_ccw.npy", "arctic_pro_cw.npy",
+    "caecer_gp.npy", "caecer_loop.npy", "dubai_open.npy",
+    "dubai_open_ccw.npy", "dubai_open_cw.npy", "dubai_pro.npy",
+    "hamption_open.npy", "hamption_pro.npy", "jyllandsringen_open.npy",
+    "jyllandsringen_open_ccw.npy", "jyllandsringen_open_cw.npy", "jyllandsringen_pro.npy",
+    "jyllandsringen_pro_ccw.npy", "jyllandsringen_pro_cw.npy", "morgan_open.npy",
+    "morgan_pro.npy", "penbay_open.npy", "penbay_open_ccw.npy",
+    "penbay_open_cw.npy", "penbay_pro.npy", "penbay_pro_ccw.npy",
+    "penbay_pro_cw.npy", "reInvent2019_track.npy", "reInvent2019_track_ccw.npy",
+    "reInvent2019_track_cw.npy", "reInvent2019_wide.npy", "reInvent2019_wide_ccw.npy",
+    "reInvent2019_wide_cw.npy", "reInvent2019_wide_mirrored.npy", "red_star_open.npy",
+    "red_star_pro.npy", "red_star_pro_ccw.npy", "red_star_pro_cw.npy",
+    "reinvent_base.npy", "thunder_hill_open.npy", "thunder_hill_pro.npy",
+    "thunder_hill_pro_ccw.npy", "thunder_hill_pro_cw.npy"
+]
+
+
+def fetch_track(name):
+    """Download a catalog track; raises on HTTP errors."""
+    response = requests.get(f"{base_url}{name}")
+    response.raise_for_status()
+    return np.load(BytesIO(response.content), allow_pickle=True)
+
+
+def _thumbnail(line):
+    step = max(1, len(line) // THUMBNAIL_POINTS)
+    return np.round(line[::step], 2).tolist()
+
+
+def track_metadata(name, waypoints):
+    """Summary of one track: size, width, direction, curvature and a small preview outline."""
+    waypoints = np.asarray(waypoints, dtype=np.float64)
+    center_line = waypoints[:, 0:2]
+    width = np.linalg.norm(waypoints[:, 2:4] - waypoints[:, 4:6], axis=1)
+    # Shoelace signed area: positive when the center line runs counter-clockwise
+    x, y = center_line[:, 0], center_line[:, 1]
+    signed_area = 0.5 * np.sum(x * np.roll(y, -1) - np.roll(x, -1) * y)
+    curvature = line_curvature(center_line[:-1])
+    xs, ys = waypoints[:, 0::2], waypoints[:, 1::2]
+    return {
+        "name": name,
+        "length": float(np.linalg.norm(np.diff(center_line, axis=0), axis=1).sum()),
+        "min_width": float(width.min()),
+        "mean_width": float(width.mean()),
+        "waypoints": len(waypoints),
+        "bbox": [float(xs.min()), float(ys.min()), float(xs.max()), float(ys.max())],
+        "direction": "ccw" if signed_area > 0 else "cw",
+        "max_curvature": float(curvature.max()),
+        "mean_curvature": float(curvature.mean()),
+        "thumbnail": {
+            "center": _thumbnail(center_line),
+            "inner": _thumbnail(waypoints[:, 2:4]),
+            "outer": _thumbnail(waypoints[:, 4:6]),
+        },
+    }
+
+
+def build_catalog_index(names=None, path=CATALOG_INDEX_PATH, workers=8, fetch=fetch_track):
+    """Fetch every catalog track once and write their metadata to path; returns (index, failed names).
+
+    Tracks that are reversed or mirrored copies of an earlier layout get "variant_of" and "variant" fields.
+    """
+    names = tracks if names is None else names
+
+    def describe(name):
+        try:
+            return fetch(name)
+        except Exception as e:
+            return e
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = dict(zip(names, pool.map(describe, names)))
+    failed = [name for name, result in results.items() if isinstance(result, Exception)]
+    loaded = {name: result for name, result in results.items() if not isinstance(result, Exception)}
+    index = [track_metadata(name, waypoints) for name, waypoints in loaded.items()]
+    variants = find_variants(loaded)
+    for entry in index:
+        if entry["name"] in variants:
+            original, variant = variants[entry["name"]]
+            entry["variant_of"] = original
+            entry["variant"] = variant_name(variant)
+    with open(path, "w") as f:
+        json.dump({"version": 1, "tracks": index}, f, separators=(",", ":"))
+    return index, failed
+
+
+def load_catalog_index(path=CATALOG_INDEX_PATH):
+    """Metadata for catalog tracks keyed by name, or an empty dict if the index has not been built."""
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return {entry["name"]: entry for entry in json.load(f)["tracks"]}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the track catalog metadata index")
+    parser.add_argument("--output", default=CATALOG_INDEX_PATH)
+    parser.add_argument("--workers", type=int, default=8)
+    args = parser.parse_args()
+    index, failed = build_catalog_index(path=args.output, workers=args.workers)
+    print(f"Indexed {len(index)} tracks into {args.output}")
+    print(f"{sum('variant_of' in entry for entry in index)} are reversed or mirrored copies of another layout")
+    if failed:
+        print("Failed: " + ", ".join(failed))
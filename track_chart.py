@@ -0,0 +1,145 @@
+import numpy as np
+
+from track_resample import open_loop
+
+# Chart width in pixels; lines are decimated to about one point per pixel at this width
+CHART_WIDTH_PX = 800
+# Upper bound on segments sent per line, whatever the zoom
+MAX_CHART_POINTS = 4000
+BORDER_COLORS = {"center line": "#999999", "inner border": "cyan", "outer border": "cyan"}
+
+
+def decimate_line(line, tolerance):
+    '''Indexes of the points of an open polyline to keep so every dropped point lies within tolerance of a kept one.
+
+    Keeps the first point in each tolerance-long stretch of arc length: a dropped point is less
+    than tolerance along the line, so also less than tolerance in a straight line, from a kept one.
+    '''
+    line = np.asarray(line, dtype=np.float64)
+    if len(line) < 3 or tolerance <= 0:
+        return np.arange(len(line))
+    distance = np.concatenate([[0.0], np.cumsum(np.linalg.norm(np.diff(line, axis=0), axis=1))])
+    bins = np.floor(distance / tolerance)
+    keep = np.flatnonzero(np.diff(bins, prepend=-1.0))
+    if keep[-1] != len(line) - 1:
+        keep = np.append(keep, len(line) - 1)
+    return keep
+
+
+def _visible_runs(closed, view, margin):
+    # Contiguous index runs of a closed polyline inside the view, one point past each edge so lines reach it
+    x0, y0, x1, y1 = view
+    inside = ((closed[:, 0] >= x0 - margin) & (closed[:, 0] <= x1 + margin)
+              & (closed[:, 1] >= y0 - margin) & (closed[:, 1] <= y1 + margin))
+    grown = inside.copy()
+    grown[1:] |= inside[:-1]
+    grown[:-1] |= inside[1:]
+    indexes = np.flatnonzero(grown)
+    if len(indexes) == 0:
+        return []
+    return np.split(indexes, np.flatnonzero(np.diff(indexes) > 1) + 1)
+
+
+def _line_segments(line, view, tolerance, max_points):
+    # (start points, end points, start indexes) of the decimated visible segments of a closed line
+    line = open_loop(line)[:, :2]
+    closed = np.vstack([line, line[:1]])
+    runs = _visible_runs(closed, view, tolerance)
+    visible = sum(np.linalg.norm(np.diff(closed[run], axis=0), axis=1).sum() for run in runs)
+    tolerance = max(tolerance, visible / max_points)
+    starts, ends, indexes = [], [], []
+    for run in runs:
+        kept = run[decimate_line(closed[run], tolerance)]
+        starts.append(closed[kept[:-1]])
+        ends.append(closed[kept[1:]])
+        indexes.append(kept[:-1] % len(line))
+    if not starts:
+        return np.empty((0, 2)), np.empty((0, 2)), np.empty(0, dtype=int)
+    return np.concatenate(starts), np.concatenate(ends), np.concatenate(indexes)
+
+
+def track_bounds(*lines):
+    '''(x0, y0, x1, y1) box around every point of the given lines'''
+    points = np.concatenate([np.asarray(line, dtype=np.float64)[:, :2] for line in lines if line is not None])
+    return (*points.min(axis=0), *points.max(axis=0))
+
+
+def section_bounds(line, start, stop, margin=0.5):
+    '''Box around points start..stop (inclusive) of a line, widened by margin'''
+    points = open_loop(line)[start:stop + 1, :2]
+    return (*(points.min(axis=0) - margin), *(points.max(axis=0) + margin))
+
+
+def track_chart(waypoints=None, race_line=None, speed=None, view=None, title="", width_px=CHART_WIDTH_PX,
+                max_points=MAX_CHART_POINTS):
+    '''Columns and Vega-Lite spec for a client-side track chart that pans and zooms in the browser.
+
+    Every line is clipped to view (x0, y0, x1, y1; default the whole track) and decimated to
+    about one point per pixel, so the data sent stays bounded however dense the lines are;
+    asking again with a smaller view sends the full detail of that part of the track.
+    '''
+    layers = {}
+    if waypoints is not None:
+        waypoints = np.asarray(waypoints, dtype=np.float64)
+        layers = {"center line": waypoints[:, 0:2], "inner border": waypoints[:, 2:4], "outer border": waypoints[:, 4:6]}
+    if race_line is not None:
+        layers["race line"] = np.asarray(race_line, dtype=np.float64)
+    if view is None:
+        view = track_bounds(*layers.values())
+    x0, y0, x1, y1 = view
+    # Equal scales on both axes: the chart height follows the view's aspect ratio within limits
+    aspect = (y1 - y0) / max(x1 - x0, 1e-9)
+    height_px = int(np.clip(width_px * aspect, 200, 1000))
+    if height_px / width_px > aspect:
+        pad = ((x1 - x0) * height_px / width_px - (y1 - y0)) / 2
+        y0, y1 = y0 - pad, y1 + pad
+    else:
+        pad = ((y1 - y0) * width_px / height_px - (x1 - x0)) / 2
+        x0, x1 = x0 - pad, x1 + pad
+    tolerance = (x1 - x0) / width_px
+
+    columns = {"layer": [], "x": [], "y": [], "x2": [], "y2": [], "speed": []}
+    for name, line in layers.items():
+        starts, ends, indexes = _line_segments(line, (x0, y0, x1, y1), tolerance, max_points)
+        columns["layer"] += [name] * len(starts)
+        for key, values in (("x", starts[:, 0]), ("y", starts[:, 1]), ("x2", ends[:, 0]), ("y2", ends[:, 1])):
+            columns[key].append(values.astype(np.float32))
+        values = np.full(len(starts), np.nan) if name != "race line" or speed is None else np.asarray(speed)[indexes]
+        columns["speed"].append(values.astype(np.float32))
+    for key in ("x", "y", "x2", "y2", "speed"):
+        columns[key] = np.concatenate(columns[key]) if columns[key] else np.empty(0, dtype=np.float32)
+
+    position = {
+        "x": {"field": "x", "type": "quantitative", "scale": {"domain": [x0, x1], "zero": False}, "title": None},
+        "y": {"field": "y", "type": "quantitative", "scale": {"domain": [y0, y1], "zero": False}, "title": None},
+        "x2": {"field": "x2"},
+        "y2": {"field": "y2"},
+    }
+    border_layer = {
+        "transform": [{"filter": "datum.layer != 'race line'"}],
+        "mark": {"type": "rule", "strokeWidth": 1.5},
+        "encoding": dict(position, color={"field": "layer", "type": "nominal", "title": None, "scale": {
+            "domain": list(BORDER_COLORS), "range": list(BORDER_COLORS.values())}}),
+        # Drag to pan and scroll to zoom, all in the browser
+        "params": [{"name": "view", "select": "interval", "bind": "scales"}],
+    }
+    if speed is None:
+        race_color = {"value": "orange"}
+    else:
+        race_color = {"field": "speed", "type": "quantitative", "title": "speed", "scale": {"scheme": "redblue", "reverse": True}}
+    race_layer = {
+        "transform": [{"filter": "datum.layer == 'race line'"}],
+        "mark": {"type": "rule", "strokeWidth": 3},
+        "encoding": dict(position, color=race_color),
+    }
+    spec = {
+        "title": {"text": title, "color": "white"},
+        "width": width_px,
+        "height": height_px,
+        "background": "black",
+        "layer": [border_layer, race_layer],
+        "resolve": {"scale": {"color": "independent"}},
+        "config": {"axis": {"labelColor": "white", "gridColor": "gray", "gridDash": [4, 4], "domainColor": "gray"},
+                   "legend": {"labelColor": "white", "titleColor": "white"}, "view": {"stroke": None}},
+    }
+    return columns, spec
@@ -0,0 +1,37 @@
+import numpy as np
+
+
+def open_loop(line):
+    '''Closed line without its closing point, if the last point repeats the first'''
+    line = np.asarray(line, dtype=np.float64)
+    if len(line) > 1 and np.allclose(line[0], line[-1]):
+        return line[:-1]
+    return line
+
+
+def resample_closed_line(line, npoints):
+    '''npoints evenly spaced by arc length around a closed line (returned open, without a closing point)'''
+    line = open_loop(line)
+    closed = np.vstack([line, line[:1]])
+    distance = np.concatenate([[0.0], np.cumsum(np.linalg.norm(np.diff(closed, axis=0), axis=1))])
+    targets = np.linspace(0.0, distance[-1], npoints, endpoint=False)
+    return np.column_stack([np.interp(targets, distance, closed[:, k]) for k in range(closed.shape[1])])
+
+
+def points_for_spacing(line, spacing):
+    '''How many points give about the requested spacing around a closed line'''
+    closed = np.vstack([open_loop(line), open_loop(line)[:1]])
+    length = np.linalg.norm(np.diff(closed, axis=0), axis=1).sum()
+    return max(5, int(round(length / spacing)))
+
+
+def resample_track(waypoints, npoints=None, spacing=None):
+    '''Resample center line and both borders of a track to npoints (or a target spacing along the
+    center line), keeping the file layout: rows of center, inner and outer x/y with a closing row.
+    '''
+    waypoints = np.asarray(waypoints, dtype=np.float64)
+    if npoints is None:
+        npoints = points_for_spacing(waypoints[:, 0:2], spacing)
+    columns = [resample_closed_line(waypoints[:, k:k + 2], npoints) for k in (0, 2, 4)]
+    resampled = np.hstack(columns)
+    return np.vstack([resampled, resampled[:1]])
@@ -0,0 +1,97 @@
+import numpy as np
+
+from track_resample import open_loop
+
+# Largest RMS center line misfit, as a fraction of the mean track width, to call two tracks the same layout
+VARIANT_TOLERANCE = 0.05
+
+
+def _shift_alignments(a, b):
+    '''Best rotation or reflection of a onto b for every cyclic shift s pairing a[i] with b[i + s].
+
+    a and b are centred (N, 2) arrays. The 2x2 cross-covariance for all N shifts comes from
+    FFT cross-correlations, so this is O(N log N); returns (residuals, rotations) per shift.
+    '''
+    n = len(a)
+    fa = np.conj(np.fft.rfft(a, axis=0))
+    fb = np.fft.rfft(b, axis=0)
+    cov = np.stack([np.fft.irfft(fa[:, j, None] * fb, n, axis=0) for j in range(2)], axis=1)
+    u, s, vt = np.linalg.svd(cov)
+    residuals = (a ** 2).sum() + (b ** 2).sum() - 2 * s.sum(axis=1)
+    return np.maximum(residuals, 0.0), u @ vt
+
+
+def match_track_variant(source, target, tolerance=VARIANT_TOLERANCE):
+    '''How target is the source layout driven the other way round and/or mirrored, or None.
+
+    Both are waypoint arrays (center, inner and outer x/y per row) with the same number of
+    points. Allows any rotation, reflection and translation plus a change of start point and
+    direction; the returned dict is what derive_race_line needs to map solutions across.
+    '''
+    source = open_loop(source)
+    target = open_loop(target)
+    if len(source) != len(target) or len(source) < 5:
+        return None
+    source_width = np.linalg.norm(source[:, 2:4] - source[:, 4:6], axis=1)
+    target_width = np.linalg.norm(target[:, 2:4] - target[:, 4:6], axis=1)
+    limit = tolerance * target_width.mean()
+    if abs(source_width.mean() - target_width.mean()) > limit:
+        return None
+
+    source_centre = source[:, 0:2].mean(axis=0)
+    target_centre = target[:, 0:2].mean(axis=0)
+    b = target[:, 0:2] - target_centre
+    best = None
+    for reverse in (False, True):
+        a = source[::-1, 0:2] if reverse else source[:, 0:2]
+        residuals, rotations = _shift_alignments(a - source_centre, b)
+        shift = int(residuals.argmin())
+        rms = float(np.sqrt(residuals[shift] / len(a)))
+        if best is None or rms < best["rms"]:
+            best = {"reverse": reverse, "shift": shift, "rotation": rotations[shift], "rms": rms,
+                    "source_centre": source_centre, "target_centre": target_centre}
+    if best["rms"] > limit:
+        return None
+    width = source_width[::-1] if best["reverse"] else source_width
+    if np.abs(np.roll(width, best["shift"]) - target_width).max() > limit:
+        return None
+    best["mirrored"] = bool(np.linalg.det(best["rotation"]) < 0)
+    return best
+
+
+def variant_name(variant):
+    '''Short description of a variant match, e.g. "mirrored, reversed"'''
+    parts = [name for name, flag in (("mirrored", variant["mirrored"]), ("reversed", variant["reverse"])) if flag]
+    return ", ".join(parts) or "same layout"
+
+
+def derive_race_line(race_line, variant):
+    '''Map a race line solved on the source track of a match_track_variant result onto the target track'''
+    race_line = np.asarray(race_line, dtype=np.float64)[:, :2]
+    if variant["reverse"]:
+        race_line = race_line[::-1]
+    moved = (race_line - variant["source_centre"]) @ variant["rotation"] + variant["target_centre"]
+    return np.roll(moved, variant["shift"], axis=0)
+
+
+def find_variants(waypoints_by_name, tolerance=VARIANT_TOLERANCE):
+    '''Map each track that repeats an earlier layout to (name of that earlier track, variant)'''
+    lengths = {}
+    for name, waypoints in waypoints_by_name.items():
+        center_line = np.asarray(waypoints, dtype=np.float64)[:, 0:2]
+        lengths[name] = np.linalg.norm(np.diff(center_line, axis=0), axis=1).sum()
+    variants = {}
+    originals = []
+    for name, waypoints in waypoints_by_name.items():
+        for original in originals:
+            # Cheap length and point count checks first; most pairs are different layouts
+            if (abs(lengths[original] - lengths[name]) > 0.01 * lengths[name]
+                    or len(waypoints_by_name[original]) != len(waypoints)):
+                continue
+            variant = match_track_variant(waypoints_by_name[original], waypoints, tolerance)
+            if variant is not None:
+                variants[name] = (original, variant)
+                break
+        else:
+            originals.append(name)
+    return variants